@@ -7,3 +7,13 @@ from backtest.backtest import Portfolio
 from backtest.backtest import Execution
 from backtest.backtest import DataHandler
 from backtest.backtest import Backtest
+from backtest.backtest import MultiBacktest
+from backtest.vectorized import VectorizedBacktest
+from backtest.vectorized import TargetPositionStrategy
+from backtest.streaming import StreamingDataHandler
+from backtest.costs import CostModel
+from backtest.costs import FixedCommission
+from backtest.costs import PerShareCommission
+from backtest.costs import BpsSlippage
+from backtest.costs import SpreadSlippage
+from backtest.costs import SquareRootImpact
@@ -1,20 +1,147 @@
 '''Author: Jacob Atnip'''
+import itertools
+import os
+import numpy as np
 import pandas as pd
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from backtest import dataset
+from backtest import metrics
+from backtest.features import Feature
+from backtest.history import AccountHistory
+from backtest.indicators import INDICATORS,indicator_key
+from backtest.intrabar import IntrabarData
+from backtest.ledger import PositionLedger
+from backtest.orders import Order,OrderLog,PendingOrderBook,RestingOrderBook
+from backtest.profiling import Profiler
+from backtest.shared import SharedDataset
+
+#data used by the backtests of a parameter sweep, loaded once in each worker process
+_sweep_worker_data = {}
+
+def _init_sweep_worker(data_series,data_file_path,data_key,beginning_update_list,shared_name = None):
+    #loads the data for a parameter sweep once per worker process and builds the data handler the worker's backtests share
+    datahandler = DataHandler()
+    if shared_name is not None:
+        datahandler.attach_shared_data(shared_name)
+    else:
+        if data_series is None:
+            data_series = pd.read_hdf(data_file_path,key = data_key)
+        datahandler.add_data_series(data_series,list(beginning_update_list))
+    _sweep_worker_data['datahandler'] = datahandler
+
+def _run_sweep_backtest(strategy,parameters,bars_to_load,cash):
+    #runs one backtest of a parameter sweep and returns its CAGR, max drawdown and CAGR/MDD
+    backtest = Backtest(strategy = strategy)
+    for name in parameters:
+        setattr(backtest.strategy,name,parameters[name])
+    backtest.datahandler._share_data(_sweep_worker_data['datahandler'])
+    backtest.test_strategy(bars_to_load,cash,progress_bar = False)
+    backtest.analysis._calc_CAGRMDD()
+    return (backtest.analysis.CAGR,backtest.analysis.max_drawdown,backtest.analysis.CAGRMDD)
+
+#nanoseconds in one step of each datetime index resolution
+_NANOSECONDS = {'s':1000000000,'ms':1000000,'us':1000,'ns':1}
+
+def _merge_calendars(indexes):
+    #Merges the sorted date indexes of every symbol into one sorted calendar without duplicates and returns it along with
+    #the position of every date of each index in the calendar. Datetime indexes are merged as int64 nanoseconds: sorting
+    #the concatenated indexes with a stable sort merges the already sorted runs, so the cost grows with the number of dates
+    #rather than the number of symbols times the calendar length
+    tzs = {str(index.tz) for index in indexes if isinstance(index,pd.DatetimeIndex)}
+    if len(indexes) == 0 or not all(isinstance(index,pd.DatetimeIndex) for index in indexes) or len(tzs) != 1:
+        #other kinds of index are merged by pandas
+        date_index = pd.Index([]) if len(indexes) == 0 else indexes[0].append(list(indexes[1:]))
+        date_index = date_index.unique().sort_values()
+        return date_index,[date_index.get_indexer(index) for index in indexes]
+
+    tz = indexes[0].tz
+    dates = [index.asi8*_NANOSECONDS[index.unit] for index in indexes]
+    calendar = np.concatenate(dates)
+    calendar.sort(kind = 'stable')
+    if len(calendar) > 0:
+        calendar = calendar[np.concatenate(([True],calendar[1:] != calendar[:-1]))]
+
+    #asi8 holds utc nanoseconds for time zone aware indexes
+    date_index = pd.DatetimeIndex(calendar.view('datetime64[ns]'))
+    if tz is not None:
+        date_index = date_index.tz_localize('UTC').tz_convert(tz)
+    return date_index,[np.searchsorted(calendar,symbol_dates) for symbol_dates in dates]
 
 class Optimize:
 
     '''Helps run optimations for strategies'''
 
-    def create_optimization_table(self,par1,par1_range,par2,par2_range,strat_name,data_file_path,cash):
+    def parameter_sweep(self,strategy,parameters,bars_to_load = None,cash = 100000,data_series = None,data_file_path = None,
+                        data_key = 'data',beginning_update_list = [],processes = None,shared_memory = False):
 
-        ###This method needs further testing before reliable use###
+        '''Backtests a strategy for every combination of parameter values and returns a dataframe with one row per combination.
+        The index holds the parameter values and the columns are 'CAGR', 'max drawdown' and 'CAGRMDD'. Backtests are run in a pool
+        of worker processes; each worker loads the data once and reuses it for all of its backtests. Before a backtest starts each
+        parameter is set as an attribute of the strategy instance, so strategies read them with self.parameter_name. The strategy
+        class must be importable by the worker processes (defined in a module, or in a notebook on platforms that fork)
+
+        inputs:
+        strategy (class): strategy class to test
+        parameters (dict): keys are parameter names and values are iterables of the values to test for that parameter
+        bars_to_load (int): number of data bars to load, see Backtest.test_strategy. Default is None, which uses one more than the
+            largest parameter value when every parameter value is an integer (a lookback). Required for other parameters
+        cash (float): amount of cash to start each backtest with. Default is 100,000
+        data_series (pandas series): data to test on in the format used by DataHandler.add_data_series
+        data_file_path (file path): hdf file to read the data from when data_series is not passed
+        data_key (string): key of the data in the hdf file. Default is 'data'
+        beginning_update_list (list): passed to DataHandler.add_data_series
+        processes (int): number of worker processes. Default is None (one per cpu). Use 1 to run the backtests in this process
+        shared_memory (bool): loads the data once in this process and places it in shared memory for the workers to attach to
+            instead of each worker loading its own copy. Default is False'''
+
+        if data_series is None and data_file_path is None:
+            raise ValueError('pass either data_series or data_file_path')
+
+        names = list(parameters)
+        grid = list(itertools.product(*[list(parameters[name]) for name in names]))
+        if bars_to_load is None:
+            values = [value for combination in grid for value in combination]
+            if not all(isinstance(value,(int,np.integer)) and not isinstance(value,bool) for value in values):
+                raise ValueError('bars_to_load can only be derived from integer parameters, pass bars_to_load')
+            bars_to_load = max(values)+1
+
+        tasks = [(strategy,dict(zip(names,values)),bars_to_load,cash) for values in grid]
+        initargs = (data_series,data_file_path,data_key,tuple(beginning_update_list))
+
+        shared_dataset = None
+        if shared_memory and processes != 1:
+            #workers attach to the data by name, so only the name is sent to them
+            _init_sweep_worker(*initargs)
+            shared_dataset = SharedDataset.create(_sweep_worker_data.pop('datahandler'))
+            initargs = (None,None,data_key,(),shared_dataset.name)
+
+        try:
+            if processes == 1:
+                _init_sweep_worker(*initargs)
+                results = [_run_sweep_backtest(*task) for task in tasks]
+            else:
+                processes = processes or os.cpu_count()
+                #hands each worker several backtests at a time to keep inter-process traffic low
+                chunksize = max(len(tasks)//(processes*4),1)
+                with ProcessPoolExecutor(max_workers = processes,initializer = _init_sweep_worker,initargs = initargs) as executor:
+                    results = list(executor.map(_run_sweep_backtest,*zip(*tasks),chunksize = chunksize))
+        finally:
+            #the data loaded for backtests run in this process is not kept after the sweep
+            _sweep_worker_data.pop('datahandler',None)
+            if shared_dataset is not None:
+                shared_dataset.unlink()
+
+        index = pd.MultiIndex.from_tuples(grid,names = names)
+        self.optimization_results = pd.DataFrame(results,index = index,columns = ['CAGR','max drawdown','CAGRMDD'])
+        return self.optimization_results
+
+    def create_optimization_table(self,par1,par1_range,par2,par2_range,strat_name,data_file_path,cash,processes = None):
 
         '''Creates 3 tables: A CAGR table, Max Drawdown (MDD) table, and a CAGR/MDD table. The row of each table
         represents a value for the first parameter and each column represents a value for the second parameter.
         Values in the CAGR table represent the CAGR for a strategy with that particular combination of values for
-        parameter 1 and parameter 2
+        parameter 1 and parameter 2. Runs on parameter_sweep
 
         Inputs:
 
@@ -22,54 +149,29 @@ class Optimize:
         par1_range (range object): range of values to test for parameter 1
         par2 (string): name of the seconf parameter
         par2_range (range object): range of values to test for parameter 2
-        strat_name (string): name of strategy
+        strat_name (class): strategy class
         data_file_path (file path): file path for data to test on
-        cash (float): amount of cash to start backtest with'''
-        
+        cash (float): amount of cash to start backtest with
+        processes (int): number of worker processes. Default is None (one per cpu)'''
+
         #determines number of data points to load for each point in time during the backtest
         bars_to_load = max(max(par1_range),max(par2_range))+1
 
-        #Creates the optimation tables using passed values
-        self.optimization_table_max_drawdown = pd.DataFrame(0,index = par1_range,columns = par2_range)
-        self.optimization_table_max_drawdown.index.name = str(par1)
-        self.optimization_table_max_drawdown.columns.name = str(par2)
-
-        self.optimization_table_CAGR = pd.DataFrame(0,index = par1_range,columns = par2_range)
-        self.optimization_table_CAGR.index.name = str(par1)
-        self.optimization_table_CAGR.columns.name = str(par2)
-
-        self.optimization_table_CAGRMDD = pd.DataFrame(0,index = par1_range,columns = par2_range)
-        self.optimization_table_CAGRMDD.index.name = str(par1)
-        self.optimization_table_CAGRMDD.columns.name = str(par2)
+        results = self.parameter_sweep(strat_name,{str(par1):par1_range,str(par2):par2_range},bars_to_load,cash,
+                                       data_file_path = data_file_path,processes = processes)
 
-        #Determines number of backtests required
-        no_of_iterations = len(par1_range)*len(par2_range)
-        q = 1
-
-        #Runs the backtests and fills in the table
-        for i, val1 in enumerate(par1_range):
-            for j, val2 in enumerate(par2_range):
-                print('starting iteration '+str(q)+' of '+str(no_of_iterations))
-                opt = Backtest(strategy = strat_name)
-                opt.datahandler.load_data_from_excel(data_file_path,bars_to_load)
-                opt._optimize_strategy(val1,val2,cash)
-
-                opt.analysis._calc_CAGRMDD()
-
-                max_drawdown = opt.analysis.max_drawdown
-                CAGR = opt.analysis.CAGR
-                CAGRMDD = opt.analysis.CAGRMDD
-
-                self.optimization_table_max_drawdown.iloc[i,j] = max_drawdown
-                self.optimization_table_CAGR.iloc[i,j] = CAGR
-                self.optimization_table_CAGRMDD.iloc[i,j] = CAGRMDD
-
-                q+=1
+        self.optimization_table_max_drawdown = results['max drawdown'].unstack(str(par2))
+        self.optimization_table_CAGR = results['CAGR'].unstack(str(par2))
+        self.optimization_table_CAGRMDD = results['CAGRMDD'].unstack(str(par2))
 
 class Analysis:
 
     '''Houses all methods for calculating metrics used to evaluate strategy performance'''
 
+    #used by the running metrics, override in your analysis class if your bars are not daily
+    periods_per_year = 252
+    risk_free_rate = 0.0
+
     def _create_pointers(self,backtest):
         self.portfolio = backtest.portfolio
         self.execution = backtest.execution
@@ -78,6 +180,16 @@ class Analysis:
         self.account = backtest.account
         self.backtest = backtest
 
+    def _reset_running_metrics(self):
+        #creates the running metrics that are updated every bar during the backtest
+        self.running_metrics = metrics.RunningMetrics(self.periods_per_year,self.risk_free_rate)
+
+    def _update_running_metrics(self):
+        #adds the current bar to the running metrics. Read self.running_metrics in analyze to use them during the backtest
+        value = self.account.equity['account value']
+        exposure = self.account._gross_exposure/value if value > 0 else np.nan
+        self.running_metrics.update(self.datahandler.current_date,value,exposure)
+
     def analyze(self):
 
         '''Create an analysis class that inherits from this class and create an analyze function where you 
@@ -86,20 +198,21 @@ class Analysis:
         pass
 
     def _create_underwater_plot(self):
-        #Creates underwater plot of results
-        underwater_plot = self.account.account_results.loc[:,['value']]
-        underwater_plot.loc[:,'max'] = 0
-        for i in range(len(self.portfolio.results)):
-            max_val = self.portfolio.results.iloc[0:i,0].max()
-            underwater_plot.iloc[i-1,1] = max_val
-        underwater_plot.iloc[-1,1] = underwater_plot.iloc[:,0].max()
+        #Creates underwater plot of results: the account value, its running maximum and the drawdown from that maximum
+        values = self.account.account_results.loc[:,'value'].to_numpy(dtype = np.float64)
+        underwater_plot = self.account.account_results.loc[:,['value']].copy()
+        underwater_plot.loc[:,'max'] = metrics.running_max(values)
+        underwater_plot.loc[:,'drawdown'] = metrics.drawdown(values)
         self.underwater_plot = underwater_plot
 
     def _calc_drawdown(self):
-        #calculaes the max drawdown from the under water plot
+        #calculates the max drawdown, the longest drawdown and the recovery time of the max drawdown from the under water plot
         self._create_underwater_plot()
-        self.drawdown_df = -(1-(self.underwater_plot.loc[:,'portfolio value']/self.underwater_plot.loc[:,'max']))
+        values = self.underwater_plot.loc[:,'value'].to_numpy()
+        self.drawdown_df = self.underwater_plot.loc[:,'drawdown']
         self.max_drawdown = self.drawdown_df.min()
+        self.max_drawdown_duration = metrics.max_drawdown_duration(values)
+        self.recovery_time = metrics.recovery_time(values)
 
     def _calc_CAGR(self):
         #Calculuates the CAGR
@@ -150,6 +263,10 @@ class Account:
 
     '''This class contains methods for handling delisted securities, updating the account, changing the account in response to orders,
     and updating account history'''
+
+    #how the cost of units that are sold or covered is taken from a position's lots: 'FIFO', 'LIFO' or 'average'.
+    #Override in your account class to change it
+    lot_method = 'FIFO'
     
     def _create_pointers(self,backtest):
         self.portfolio = backtest.portfolio
@@ -160,376 +277,182 @@ class Account:
         self.backtest = backtest
         
     def _reset_account(self, cash = 100000):
-        #Creates an assets, liabilities, and equity dictionary. Creates two dataframe: account history and account results dataframe
-        self.assets = {'cash':cash}
-        self.liabilities = {'borrowed funds':0}
+        #Sets the cash, borrowed funds and equity of the account, creates the position ledger and the account history store
+        self.cash = cash
+        self.borrowed_funds = 0
         self.equity = {'account value':cash}
-        self.account_history = pd.DataFrame({'assets':[() for i in self.datahandler.date_index],'liabilities':[() for i in self.datahandler.date_index],'equity':[() for i in self.datahandler.date_index]},index = self.datahandler.date_index)
-        self.account_history.iloc[0,0] = (deepcopy(self.assets),)
-        self.account_history.iloc[0,1] = (deepcopy(self.liabilities),)
-        self.account_history.iloc[0,2] = (deepcopy(self.equity),)
-        self.account_results = pd.DataFrame({'cash':[() for i in self.datahandler.date_index],'value':[() for i in self.datahandler.date_index]},index = self.datahandler.date_index)
+        self.ledger = PositionLedger(self.datahandler.sym_list,self.lot_method)
+        #signed quantity of every symbol, the same array as the ledger's
+        self._quantity = self.ledger.quantity
+        self._gross_exposure = 0.0
+        self.history = AccountHistory(self.datahandler.date_index,self.datahandler.sym_list,cash,
+                                      record_positions = self.datahandler._keeps_full_history)
+
+    @property
+    def assets(self):
+
+        '''Dictionary with the cash and a position dictionary for every long position, built from the position ledger when it
+        is read. Changing it does not change the account'''
+
+        assets = {'cash':self.cash}
+        for row in self.ledger.held_rows[self.ledger.quantity[self.ledger.held_rows] > 0].tolist():
+            assets[self.ledger.sym_array[row]] = self._position_dict(row)
+        return assets
+
+    @property
+    def liabilities(self):
+
+        '''Dictionary with the borrowed funds and a position dictionary for every short position (with positive quantities),
+        built from the position ledger when it is read. Changing it does not change the account'''
+
+        liabilities = {'borrowed funds':self.borrowed_funds}
+        for row in self.ledger.held_rows[self.ledger.quantity[self.ledger.held_rows] < 0].tolist():
+            liabilities[self.ledger.sym_array[row]] = self._position_dict(row)
+        return liabilities
+
+    def _position_dict(self,row):
+        #returns the position of a symbol row in the position dictionary format
+        ledger = self.ledger
+        return {'value':abs(ledger.value[row]),
+                'quantity':abs(ledger.quantity[row]),
+                'start of position':self.datahandler.date_index[ledger.open_bar[row]],
+                'most recent order':self.execution.order_log.orders[ledger.last_order[row]],
+                'cost basis':ledger.cost_basis[row],
+                'ladder':ledger.lots.ladder(row)}
+
+    @property
+    def account_history(self):
+
+        '''Dataframe with the cash, borrowed funds, account value and the quantity and value of every symbol held during the
+        backtest for each bar. Built from the account history store the first time it is read after a bar is recorded'''
+
+        if not self.history.record_positions:
+            return self.history.account_history(None)
+        return self.history.account_history(self.datahandler._field_array('close'))
+
+    @property
+    def account_results(self):
+
+        '''Dataframe with the cash and account value for each bar'''
+
+        return self.history.account_results()
+
+    @property
+    def realized_lots(self):
+
+        '''Dataframe with one row for every lot closed during the backtest (fully or partly) with its symbol, side, units,
+        open and close dates and prices and realized profit and loss. Lots are matched with the lot_method of the account'''
+
+        return self.ledger.lots.realized_frame(self.datahandler.sym_list,self.datahandler.date_index)
 
     def _remove_delisted_securities(self):
-        #Handles the removal of delisted securities each bar
-        #First handles securities that are owned and have been deslited
-        del_list1 = []
-        for asset in self.assets:
-            if asset != 'cash' and asset not in self.datahandler.available_symbols:
-                del_list1.append(asset)
-                if self.assets[asset]['value'] >= self.liabilities['borrowed funds']:
-                            self.assets['cash'] = self.assets['cash']+self.assets[asset]['value'] - self.liabilities['borrowed funds']
-                            self.liabilities['borrowed funds'] = 0
-                else:
-                    self.liabilities['borrowed funds'] = self.liabilities['borrowed funds'] - self.assets[asset]['value']
-
-        for asset in del_list1:
-            del self.assets[asset]
-
-        #Then removes securities that are shorted (liabilities) and have been delisted
-        del_list2 = []
-        for liability in self.liabilities:
-            if liability != 'borrowed funds' and liability not in self.datahandler.available_symbols:
-                del_list2.append(liability)
-                if self.liabilities[liability]['value'] <= self.assets['cash']:
-                            self.assets['cash'] = self.assets['cash'] - self.liabilities[liability]['value'] 
-
-                else:
-                    self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+(self.liabilities[liability]['value']  - self.assets['cash'])
-                    self.assets['cash'] = 0
-
-        for liability in del_list2:
-            del self.liabilities[liability]
-
-        #Removes any delisted securities from pending order 
-        pending_orders = [order for order in self.execution.pending_orders if self.execution.pending_orders[order]['symbol'] in del_list1 or self.execution.pending_orders[order]['symbol'] in del_list2]
-        for order in pending_orders:
-            del self.execution.pending_orders[order]
-            
+        #Closes the positions of held symbols that are not available on this bar at the value they were last marked at.
+        #Long positions are sold first, paying back borrowed funds, then short positions are bought back
+        held_rows = self.ledger.held_rows
+        delisted = held_rows[~np.isin(held_rows,self.datahandler._available_rows)]
+        if len(delisted) > 0:
+            values = self.ledger.value[delisted]
+            self._move_cash(-values[values < 0].sum(),values[values > 0].sum(),0)
+            self.ledger.close(delisted,self.datahandler._current_bar)
+
+        #Removes pending and resting orders for the positions closed above and for symbols without data on this bar, which
+        #have no price to fill at. Orders for other symbols that have data but are not available yet are kept
+        symbols = self.execution.pending_orders.symbols()
+        if symbols:
+            rows = np.array([self.datahandler._sym_to_row[symbol] for symbol in symbols])
+            cancel = ~self.datahandler._has_bar(rows) | np.isin(rows,delisted)
+            for symbol in np.asarray(symbols,dtype = object)[cancel].tolist():
+                self.execution.pending_orders.remove_symbol(symbol)
+        if len(self.execution.resting_orders) > 0:
+            rows = np.unique(self.execution.resting_orders._columns()['row'])
+            keep = np.zeros(len(self.datahandler.sym_list),dtype = bool)
+            keep[rows] = self.datahandler._has_bar(rows)
+            keep[delisted] = False
+            self.execution.resting_orders.keep_available(keep)
 
     def _update_account_begin(self):
         #Updates the account at the beginning of the current bar
-
-        values = []
-        #update asset values
-        for asset in self.assets:
-            if asset != 'cash':
-                asset_data = self.assets[asset]
-                asset_data['value'] = asset_data['quantity']*self.datahandler._data_series[asset]['open'][self.datahandler.current_date]
-                values.append(asset_data['value'])
-                self.assets[asset].update(asset_data)
-
-        #update liability values
-        for liability in self.liabilities:
-            if liability != 'borrowed funds':
-                liability_data = self.liabilities[liability]
-                liability_data['value'] = liability_data['quantity']*self.datahandler._data_series[liability]['open'][self.datahandler.current_date]
-                values.append(-liability_data['value'])
-                self.liabilities[liability].update(liability_data)
-
-        #update equity values
-        self.equity['account value'] = sum(values)+self.assets['cash']-self.liabilities['borrowed funds']
-        
-        #Update the portfolio.positions tuple
-        self.portfolio.positions = [asset for asset in self.assets if asset != 'cash']
-        self.portfolio.positions = self.portfolio.positions + [liability for liability in self.liabilities if liability != 'borrowed funds']
-        self.portfolio.positions = tuple(self.portfolio.positions)
+        self._mark_to_market('open')
 
     def _update_account_end(self):
         #Updates the account at the end of the current bar
+        self._mark_to_market('close')
 
-        values = []
-
-        #updates asset values
-        for asset in self.assets:
-            if asset != 'cash':
-                asset_data = self.assets[asset]
-                asset_data['value'] = asset_data['quantity']*self.datahandler._data_series[asset]['close'][self.datahandler.current_date]
-                values.append(asset_data['value'])
-                self.assets[asset].update(asset_data)
-
-        #updates the value of liabilities
-        for liability in self.liabilities:
-            if liability != 'borrowed funds':
-                liability_data = self.liabilities[liability]
-                liability_data['value'] = liability_data['quantity']*self.datahandler._data_series[liability]['close'][self.datahandler.current_date]
-                values.append(-liability_data['value'])
-                self.liabilities[liability].update(liability_data)
-
-        #updates equity value
-        self.equity['account value'] = sum(values)+self.assets['cash']-self.liabilities['borrowed funds']
-        
-        #updates the portfolio positions tuple
-        self.portfolio.positions = [asset for asset in self.assets if asset != 'cash']
-        self.portfolio.positions = self.portfolio.positions + [liability for liability in self.liabilities if liability != 'borrowed funds']
-        self.portfolio.positions = tuple(self.portfolio.positions)
+    def _mark_to_market(self,data_type):
+        #Values every position at the current bar's price of data_type and updates the account value
+        value,self._gross_exposure = self.ledger.mark(self.datahandler._current_prices(data_type))
+        self.equity['account value'] = value+self.cash-self.borrowed_funds
         
     def _update_account_history_and_results(self):
-        #updates the account history and account results dataframes
-
-        self.account_history['assets'][self.datahandler.current_date] = deepcopy(self.assets)
-        self.account_history['liabilities'][self.datahandler.current_date] = deepcopy(self.liabilities)
-        self.account_history['equity'][self.datahandler.current_date] = deepcopy(self.equity)
-        self.account_results['cash'][self.datahandler.current_date] = self.assets['cash']
-        self.account_results['value'][self.datahandler.current_date] = self.equity['account value']
-
-    def _calculate_change_cost_basis_and_new_ladder_FIFO(self,shares,ladder):
-        #Updates the cost basis and position ladder using the FIFO method
-
-        share_count = 0
-        cost = 0
-        change = 0
-
-        ###Needs additional documentation here###
-        for i,pairs in enumerate(ladder):
-            shs = pairs[0]
-            cst = shs*pairs[1]
-            share_count = share_count + shs
-            cost = cst+cost
-            if shares <= share_count:
-                diff = share_count - shares
-                change = cost - diff*pairs[1]
-                break
-                
-        if diff != 0:
-            ladder[i] = (diff,ladder[i][1])
-            j = i-1
+        #records the current bar in the account history store
+
+        held_rows = self.ledger.held_rows
+        self.history.record(self.datahandler._current_bar,self.cash,self.borrowed_funds,self.equity['account value'],held_rows,
+                            self._quantity[held_rows])
+
+    def _update_position_with_order(self,order):
+        #Updates the position of the order's symbol in the position ledger. Cash and borrowed funds are moved separately by _move_cash
+        self.ledger.fill(self.datahandler._sym_to_row[order.symbol],order.quantity,order.execution_price,
+                         self.datahandler._current_bar,order.ID)
+
+    def _move_cash(self,bought_value,sold_value,shorted_value):
+        #Moves cash and borrowed funds for orders. Sales from long positions pay back borrowed funds first and add the rest
+        #to cash, cash from short sales is placed in the cash account and purchases (including covering shorts) use cash
+        #first and then borrowed funds
+        if sold_value >= self.borrowed_funds:
+            self.cash = self.cash+(sold_value-self.borrowed_funds)
+            self.borrowed_funds = 0
         else:
-            j = i
-            
-        if j == 0:
-            del ladder[j]
+            self.borrowed_funds = self.borrowed_funds-sold_value
+
+        self.cash = self.cash+shorted_value
+
+        if bought_value <= self.cash:
+            self.cash = self.cash-bought_value
         else:
-            ij = len(ladder) - j
-            for s in range(j+1):
-                del ladder[-ij]
+            self.borrowed_funds = self.borrowed_funds+(bought_value-self.cash)
+            self.cash = 0
+
+    def _pay_costs(self,costs):
+        #Lowers the account value by the trading costs of fills. Apart from their costs, fills are at the price the account
+        #was last marked at (resting orders are filled before the account is marked at the close), so the account value
+        #stays the value of the positions, cash and borrowed funds without marking the account again
+        if costs:
+            self.equity['account value'] = self.equity['account value']-costs
 
-        return (change,ladder)
-    
     def _update_account_with_order(self,order):
         #Updates the account whenever an order is executed
-
-        if order['symbol'] not in self.assets and order['symbol'] not in self.liabilities:
-            #There is not a position open for this symbol
-
-            if order['quantity'] >0:
-                #order creates a long position
-
-                quantity = order['quantity']
-                value = abs(quantity*order['execution price'])
-                cost_basis = value
-                ladder = [(abs(quantity),order['execution price'])]
-                pos_dict = {'value':value,
-                'quantity':quantity,
-                'start of position':self.datahandler.current_date,
-                'most recent order':order,
-                'cost basis':cost_basis,
-                'ladder':ladder}
-
-                #determine whether position is bought with cash or a mixture of cash and borrowed funds
-                if value <= self.assets['cash']:
-                    self.assets['cash'] = self.assets['cash'] - value
-                else:
-                    self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+(value - self.assets['cash'])
-                    self.assets['cash'] = 0
-
-                #add position to assets account 
-                self.assets[order['symbol']] = pos_dict
-
-            #Creates position dictionary for short positio
-            elif order['quantity'] < 0:
-                #order creates a short position
-
-                quantity = order['quantity']
-                value = abs(quantity*order['execution price'])
-                cost_basis = value
-                ladder = [(abs(quantity),order['execution price'])]
-                pos_dict = {'value':value,
-                'quantity':quantity,
-                'start of position':self.datahandler.current_date,
-                'most recent order':order,
-                'cost basis':cost_basis,
-                'ladder':ladder}
-
-                #Updates cash account and liabilities account
-                self.assets['cash'] = self.assets['cash']+value
-                self.liabilities[order['symbol']] = pos_dict
-
+        price = order.execution_price
+        if order.quantity > 0:
+            self._move_cash(order.quantity*price,0,0)
         else:
-            #There is a current position open for this symbol
-            if order['symbol'] in self.assets:
-                #there is a long position for this symbol
-
-                if order['quantity'] + self.assets[order['symbol']]['quantity'] > 0:
-                    #current order still maintains long position
-
-                    quantity = abs(order['quantity'] + self.assets[order['symbol']]['quantity'])
-                    value = quantity*order['execution price']
-                    if order['quantity'] > 0:
-                        #order creates larger long position
-                        cost_basis = abs(order['quantity'])*order['execution price'] + self.assets[order['symbol']]['cost basis']
-                        ladder = self.assets[order['symbol']]['ladder'] + [(abs(order['quantity']),order['execution price'])]
-
-                        if (order['quantity']*order['execution price']) <= self.assets['cash']:
-                            #order uses only cash
-                            self.assets['cash'] = self.assets['cash'] - (order['quantity']*order['execution price'])
-
-                        else:
-                            #order will use borrowed funds 
-                            self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+((order['quantity']*order['execution price']) - self.assets['cash'])
-                            self.assets['cash'] = 0
-
-                    else:
-                        #order decreases the size of the long position
-                        cost_basis_change,ladder = self._calculate_change_cost_basis_and_new_ladder_FIFO(abs(order['quantity']),self.assets[order['symbol']]['ladder'])
-                        cost_basis = self.assets[order['symbol']]['cost basis'] - cost_basis_change
-
-                        if (abs(order['quantity'])*order['execution price']) >= self.liabilities['borrowed funds']:
-                            #order completely pays back borrowed funds
-                            self.assets['cash'] = self.assets['cash']+((abs(order['quantity'])*order['execution price']) - self.liabilities['borrowed funds'])
-                            self.liabilities['borrowed funds'] = 0
-                        else:
-                            #order does not completely pay back borrowed funds
-                            self.liabilities['borrowed funds'] = self.liabilities['borrowed funds'] - ((abs(order['quantity'])*order['execution price']))
-
-                    #finishes constructing the position dictionary
-                    pos_dict = {'value':value,
-                    'quantity':quantity,
-                    'most recent order':order,
-                    'cost basis':cost_basis,
-                    'ladder':ladder}
-
-                    #updates the asset account with the new position dictionary
-                    self.assets[order['symbol']].update(pos_dict)
-
-                elif order['quantity'] + self.assets[order['symbol']]['quantity'] <0:
-                    #current order changes the long position to a short position
-
-                    quantity = abs(order['quantity'] + self.assets[order['symbol']]['quantity'])
-                    value = quantity*order['execution price']
-                    cost_basis = value
-                    ladder = [(quantity,order['execution price'])]
-                    pos_dict = {'value':value,
-                    'quantity':quantity,
-                    'start of position':self.datahandler.current_date,
-                    'most recent order':order,
-                    'cost basis':cost_basis,
-                    'ladder':ladder}
-
-                    if (self.assets[order['symbol']]['quantity']*order['execution price']) >= self.liabilities['borrowed funds']:
-                        #order pays back all of the current borrowed funds
-                        self.assets['cash'] = self.assets['cash'] + ((self.assets[order['symbol']]['quantity']*order['execution price']) - self.liabilities['borrowed funds']) + (quantity*order['execution price'])
-                        self.liabilities['borrowed funds'] = 0
-                    else:
-                        #order does not pay back all of the current borrowed funds
-                        self.liabilities['borrowed funds'] = self.liabilities['borrowed funds'] - (self.assets[order['symbol']]['quantity']*order['execution price'])
-                        #cash from short positions is placed in cash account and not used to pay back borrowed funds
-                        ###Check to see if this is the correct logic###
-                        self.assets['cash'] = self.assets['cash'] + quantity*order['execution price']
-
-                    #removes the position from the assets and adds the new short position to the liabilities account
-                    del self.assets[order['symbol']]
-                    self.liabilities[order['symbol']] = pos_dict
-
-
-                elif (order['quantity'] + self.assets[order['symbol']]['quantity'])==0:
-                    #order closes the long position
-
-                    if (abs(order['quantity'])*order['execution price']) >= self.liabilities['borrowed funds']:
-                            #order completely pays back borrowed funds
-                        self.assets['cash'] = self.assets['cash']+((abs(order['quantity'])*order['execution price']) - self.liabilities['borrowed funds'])
-                        self.liabilities['borrowed funds'] = 0
-                    else:
-                        #order does not completely pay back borrowed funds
-                        self.liabilities['borrowed funds'] = self.liabilities['borrowed funds'] - ((abs(order['quantity'])*order['execution price']))
-                    
-                    #removes the symbol from the asset account
-                    del self.assets[order['symbol']]
-
-            elif order['symbol'] in self.liabilities:
-                #there is a short position for this symbol
-
-                if order['quantity'] + (-self.liabilities[order['symbol']]['quantity']) > 0:
-                    #order changes the short position to a long position
-
-                    quantity = abs(order['quantity'] + (-self.liabilities[order['symbol']]['quantity']))
-                    value = quantity*order['execution price']
-                    cost_basis = value
-                    ladder = [(quantity,order['execution price'])]
-                    pos_dict = {'value':value,
-                    'quantity':quantity,
-                    'start of position':self.datahandler.current_date,
-                    'most recent order':order,
-                    'cost basis':cost_basis,
-                    'ladder':ladder}
-                    
-                    if (order['quantity']*order['execution price']) <= self.assets['cash']:
-                        #order uses only cash to fund purchase
-                        self.assets['cash'] = self.assets['cash'] - (order['quantity']*order['execution price'])
-
-                    else:
-                        #order uses borrowed funds to purchase
-                        self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+((order['quantity']*order['execution price']) - self.assets['cash'])
-                        self.assets['cash'] = 0
-
-                    #removes the symbol from liabilities and adds it to the assets
-                    del self.liabilities[order['symbol']]
-                    self.assets[order['symbol']] = pos_dict
-
-
-                elif order['quantity'] + (-self.liabilities[order['symbol']]['quantity']) <0:
-                    #current order maintains short position
-
-                    quantity = abs(order['quantity'] + (-self.liabilities[order['symbol']]['quantity']))
-                    value = quantity*order['execution price']
-                    if order['quantity'] > 0:
-                        #current order reduces the size of the short position
-                        cost_basis_change,ladder = self._calculate_change_cost_basis_and_new_ladder_FIFO(abs(order['quantity']),self.liabilities[order['symbol']]['ladder'])
-                        cost_basis = self.liabilities[order['symbol']]['cost basis'] - cost_basis_change
-                        if (order['quantity']*order['execution price']) <= self.assets['cash']:
-                            #order uses only cash for purchase
-                            self.assets['cash'] = self.assets['cash'] - (order['quantity']*order['execution price'])
-
-                        else:
-                            #order uses borrowed funds for purchase
-                            self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+((order['quantity']*order['execution price']) - self.assets['cash'])
-                            self.assets['cash'] = 0
-                        
-                    else:
-                        #order increases size of short position
-                        cost_basis = abs(order['quantity'])*order['execution price'] + self.liabilities[order['symbol']]['cost basis']
-                        ladder = self.liabilities[order['symbol']]['ladder'] + [(abs(order['quantity']),order['execution price'])]
-                        self.assets['cash'] = self.assets['cash']+abs(order['quantity'])*order['execution price']
-
-                    #updates position dictionary
-                    pos_dict = {'value':value,
-                    'quantity':quantity,
-                    'most recent order':order,
-                    'cost basis':cost_basis,
-                    'ladder':ladder}
-
-                    #updates the liabilities account
-                    self.liabilities[order['symbol']].update(pos_dict)
-
-                elif order['quantity'] + (-self.liabilities[order['symbol']]['quantity'])==0:
-                    #order closes the short position
-
-                    if (order['quantity']*order['execution price']) <= self.assets['cash']:
-                        #order uses only cash to close short
-                            self.assets['cash'] = self.assets['cash'] - (order['quantity']*order['execution price'])
-
-                    else:
-                        #order uses borrowed funds to close short
-                        ###Is this the correct logic?###
-                        self.liabilities['borrowed funds'] = self.liabilities['borrowed funds']+((order['quantity']*order['execution price']) - self.assets['cash'])
-                        self.assets['cash'] = 0
-
-                    #removes order from the liabilities account
-                    del self.liabilities[order['symbol']]
+            #the part of a sale covered by a long position is sold, the rest opens or adds to a short position
+            held = self._quantity[self.datahandler._sym_to_row[order.symbol]]
+            sold = min(-order.quantity,max(held,0))
+            self._move_cash(0,sold*price,(-order.quantity-sold)*price)
+        if order.commission:
+            self._move_cash(order.commission,0,0)
+        self._pay_costs((order.commission or 0)+(order.slippage or 0))
+        self._update_position_with_order(order)
+
+    def _update_account_with_orders(self,orders,rows,quantities,prices):
+        #Updates the account for a batch of orders executed together, one per symbol row. The cash movements of the whole
+        #batch are summed and applied at once: sales first, then short sales, then purchases
+        held = self._quantity[rows]
+        sold = np.where(quantities < 0,np.minimum(-quantities,np.maximum(held,0)),0)
+        shorted = np.where(quantities < 0,-quantities-sold,0)
+        bought = np.where(quantities > 0,quantities,0)
+        self._move_cash(np.dot(bought,prices),np.dot(sold,prices),np.dot(shorted,prices))
+        commissions = sum(order.commission for order in orders if order.commission)
+        if commissions:
+            self._move_cash(commissions,0,0)
+        self._pay_costs(commissions+sum(order.slippage for order in orders if order.slippage))
+        for order in orders:
+            self._update_position_with_order(order)
 
 class Portfolio:
 
-    '''This class contains the positions tuple and a method for resetting this tuple at the beginning of each backtest'''
+    '''This class gives access to the positions tuple, the symbols the account holds'''
 
     def _create_pointers(self,backtest):
         self.execution = backtest.execution
@@ -539,14 +462,25 @@ class Portfolio:
         self.account = backtest.account
         self.backtest = backtest
 
+    @property
+    def positions(self):
+
+        '''Tuple of the symbols with an open long or short position, in sym_list order. Read from the account's position ledger,
+        so it includes orders executed earlier in the current bar'''
+
+        return self.account.ledger.positions
+
     def _reset_portfolio(self):
-        #resets portfolio
-        self.positions = ()
+        #positions are read from the account's position ledger, which is reset with the account
+        pass
             
 class Execution:
 
     '''This class handles all methods and data related to pending and executing orders'''
 
+    #trading cost models (see backtest.costs) applied to every fill. Override in your execution class to add costs
+    cost_models = ()
+
     def _create_pointers(self,backtest):
         self.portfolio = backtest.portfolio
         self.datahandler = backtest.datahandler
@@ -556,58 +490,94 @@ class Execution:
         self.backtest = backtest
     
     def _clear_pending_orders(self):
-        #resets pending orders dict and the most recent order ID
-        self.pending_orders = {}
+        #resets the pending and resting order books and the most recent order ID
+        self.pending_orders = PendingOrderBook()
+        self.resting_orders = RestingOrderBook()
         self._most_recent_ID = 0
         
     def _add_pending_order(self,order):
-        #adds an order to the pending orders dictionary
-        order_ID = order['Order ID']
-        self.pending_orders[order_ID] = deepcopy(order)
+        #adds an order to the pending order book under the slot (time of bar) it is executed at
+        self.pending_orders.add(order,order.execution_time)
             
     def _execute_order(self,order):
         #executes order by updating the account with an order
         self.account._update_account_with_order(order)
-                
-    def _scan_and_execute_pending_orders(self):
-        #scans the pending orders dict and executes order if necessary
 
-        #list used to keep track of orders that need to be removed from pending list
-        removal_list = []
-        for ID in self.pending_orders:
-            order = self.pending_orders[ID]
-            order_type = order['order type']
-            
-            if order_type == 'market':
-                market_order_type = order['desired execution time']
-                if market_order_type == 'open':
-                    if self.datahandler._tob == 'begin':
-                        #chain of if/else statements ensure the market order is only executed at the beginning of the bar
-                        sym = order['symbol']
-                        sym_open_data = self.datahandler._data_series[sym]['open']
-                        execution_price = sym_open_data[self.datahandler.current_date]
-                        order.update({'execution price':execution_price, 'date of execution':self.datahandler.current_date,'execution side':'begin'})
-                        self._update_order_series(order)
-                        self._execute_order(order)
-                        removal_list.append(ID)
-                elif market_order_type == 'close':
-                    if self.datahandler._tob == 'end':
-                        #chain of if/else statements ensure the market order is only executed at the end of the bar
-                        sym = order['symbol']
-                        sym_close_data = self.datahandler._data_series[sym]['close']
-                        execution_price = sym_close_data[self.datahandler.current_date]
-                        order.update({'execution price':execution_price, 'date of execution':self.datahandler.current_date,'execution side':'end'})
-                        self._update_order_series(order)
-                        self._execute_order(order)
-                        removal_list.append(ID)
-
-        #removes pending orders that have been executed
-        self._update_pending_orders(removal_list)
-        
-    def _update_pending_orders(self,removal_list):
-        #removes pending orders that have been executed
-        for ID in removal_list:
-            del self.pending_orders[ID]
+    def _fill_order(self,order,slot):
+        #fills an order at the current bar's price for slot ('open' or 'close'), logs the fill and executes it
+        self._fill_orders([order],[self.datahandler._current_price(order.symbol,slot)],self.datahandler._tob)
+
+    def _fill_orders(self,orders,prices,side):
+        #logs and executes orders filled together on the current bar at prices, one at a time in the order given
+        unpriced = [order.symbol for order,price in zip(orders,prices) if not np.isfinite(price)]
+        if unpriced:
+            raise ValueError('no price to fill orders at for symbols: '+str(unpriced))
+        if self.cost_models:
+            prices = self._apply_costs(orders,np.asarray(prices,dtype = np.float64)).tolist()
+        bar = self.datahandler._current_bar
+        for order,price in zip(orders,prices):
+            order.execution_price = price
+            order.execution_bar = bar
+            order.execution_side = side
+            self.order_log.fill(order)
+            self._execute_order(order)
+
+    def _apply_costs(self,orders,prices,rows = None,quantities = None):
+        #computes the costs of a batch of fills with every cost model at once, records them on the orders and returns the
+        #fill prices after slippage. Commissions are paid by the account when each order is executed. Limit and stop limit orders fill at their price or better, so
+        #they only pay commissions
+        if rows is None:
+            rows = np.array([self.datahandler._sym_to_row[order.symbol] for order in orders],dtype = np.int64)
+            quantities = np.array([order.quantity for order in orders],dtype = np.float64)
+        slippage = np.zeros(len(orders))
+        commissions = np.zeros(len(orders))
+        for model in self.cost_models:
+            costs = model.costs(quantities,prices,rows,self.datahandler)
+            if model.kind == 'slippage':
+                slippage += costs
+            else:
+                commissions += costs
+        slippage[[order.limit_price is not None for order in orders]] = 0
+        #orders of zero units do not trade, so they have no costs
+        traded = quantities != 0
+        slippage[~traded] = 0
+        commissions[~traded] = 0
+
+        for order,order_slippage,commission in zip(orders,slippage.tolist(),commissions.tolist()):
+            order.slippage = order_slippage
+            order.commission = commission
+        return prices+np.sign(quantities)*np.divide(slippage,np.abs(quantities),out = np.zeros(len(orders)),where = traded)
+
+    def _scan_and_execute_pending_orders(self):
+        #executes the pending orders due at the current time of bar: market orders for the open at the beginning of the bar
+        #and market orders for the close at the end of the bar. Orders for the other slot are not looked at
+        if self.datahandler._tob == 'begin':
+            slot = 'open'
+        else:
+            slot = 'close'
+
+        orders = self.pending_orders.pop_due(slot)
+        if orders:
+            #the orders due are priced together, in the order they were placed
+            rows = np.array([self.datahandler._sym_to_row[order.symbol] for order in orders],dtype = np.int64)
+            self._fill_orders(orders,self.datahandler._current_prices(slot)[rows].tolist(),self.datahandler._tob)
+
+    def _match_resting_orders(self):
+        #fills the resting orders triggered during the current bar at their fill prices. Every resting order is checked
+        #against the bar's open, high and low at once by the resting order book
+        if len(self.resting_orders) == 0:
+            return
+        datahandler = self.datahandler
+        sub_bars = None
+        if datahandler._intrabar is not None:
+            #orders that may fill on the bar are checked against the sub-bars of their symbol within the bar
+            bar,intrabar = datahandler._current_bar,datahandler._intrabar
+            def sub_bars(row):
+                return intrabar.sub_bars(datahandler._sym_array[row],bar,datahandler.date_index)
+        fills = self.resting_orders.match(datahandler._current_bar,datahandler._current_prices('open'),
+                                          datahandler._current_prices('high'),datahandler._current_prices('low'),sub_bars)
+        if fills:
+            self._fill_orders([order for order,price in fills],[price for order,price in fills],'intrabar')
 
     def _gen_order_ID(self):
         #generates a new order ID. All order IDs are unique
@@ -615,82 +585,236 @@ class Execution:
         self._most_recent_ID += 1
         return ID
 
-    def _update_order_series(self,order):
-        #updates new order series
+    @property
+    def order_series(self):
 
-        if self.order_series.loc[self.datahandler.current_date] != ('No orders',):
-            self.order_series.loc[self.datahandler.current_date] = (self.order_series.loc[self.datahandler.current_date] +(order,))
+        '''Series with a tuple of the orders executed on each bar, built from the order log'''
 
-        elif self.order_series.loc[self.datahandler.current_date] == ('No orders',):
-            self.order_series.loc[self.datahandler.current_date] = (order,)
+        return self.order_log.order_series()
 
-    def _update_pending_order_series(self,order):
-        #updates the pending order series
+    @property
+    def pending_order_series(self):
 
-        if self.pending_order_series.loc[self.datahandler.current_date] != ('No pending orders',):
-            self.pending_order_series.loc[self.datahandler.current_date] = (self.pending_order_series.loc[self.datahandler.current_date] +(order,))
+        '''Series with a tuple of the orders placed on each bar, built from the order log'''
 
-        elif self.pending_order_series.loc[self.datahandler.current_date] == ('No pending orders',):
-            self.pending_order_series.loc[self.datahandler.current_date] = (order,)
+        return self.order_log.pending_order_series()
 
     def market_order(self,symbol,quantity,time):
 
-        '''This method is responsible for generating an order dict for a market order
+        '''This method is responsible for generating an order for a market order
 
         inputs:
-        symbol (string): symbol (stock ticker, forex pari, etc.)
+        symbol (string): symbol (stock ticker, forex pari, etc.). Orders executed immediately need data for the symbol on the current bar
         quantity (int): units of symbol to order. Use positive (negative) values for long (short) positions or covering (closing) short (long) positions.
-        time (string): 'begin' or 'end', determines time of bar the order should be executed'''
+        time (string): 'open' or 'close', determines time of bar the order should be executed'''
+
+        if time not in ('open','close'):
+            raise ValueError("time must be 'open' or 'close'")
+        #orders executed immediately need a price on the current bar
+        immediate = (time == 'open' and self.datahandler._tob == 'begin') or (time == 'close' and self.datahandler._tob == 'end')
+        if immediate and not self.datahandler._has_bar(np.array([self.datahandler._sym_to_row[symbol]]))[0]:
+            raise ValueError('symbol has no data on the current bar: '+str(symbol))
+
+        #creates the order record and adds it to the order log
+        order = Order(self._gen_order_ID(),symbol,quantity,'market',time,self.datahandler._current_bar,self.datahandler._tob,
+                      self.datahandler.date_index)
+        self.order_log.place(order)
+
+        #the order is executed immediately if its time of bar is the current time of bar, otherwise it waits in the pending orders
+        if immediate:
+            self._fill_order(order,time)
+        else:
+            self._add_pending_order(order)
+
+    def _place_resting_order(self,symbol,quantity,order_type,**levels):
+        #creates a resting order, adds it to the order log and the resting order book and returns its ID. Orders placed at
+        #the beginning of a bar can fill on that bar, orders placed at the end of a bar can fill from the next bar
+        datahandler = self.datahandler
+        for field in ('open','high','low'):
+            if field not in datahandler._field_to_row:
+                raise KeyError("resting orders need '"+field+"' data")
+        row = datahandler._sym_to_row[symbol]
+        if row not in datahandler._available_rows:
+            raise ValueError('symbol not available: '+str(symbol))
+        if quantity == 0 or not np.isfinite(quantity):
+            raise ValueError('quantity must be finite and not zero')
+        for name,level in levels.items():
+            if level is not None and not (np.isfinite(level) and level > 0):
+                raise ValueError(name+' must be finite and positive')
+
+        tob = datahandler._tob
+        order = Order(self._gen_order_ID(),symbol,quantity,order_type,None,datahandler._current_bar,tob,datahandler.date_index,
+                      **levels)
+        self.order_log.place(order)
+        start_bar = datahandler._current_bar if tob == 'begin' else datahandler._current_bar+1
+        reference = datahandler._current_price(symbol,'open' if tob == 'begin' else 'close')
+        self.resting_orders.add(order,row,start_bar,reference)
+        return order.ID
+
+    def limit_order(self,symbol,quantity,limit_price):
+
+        '''Places a limit order that rests until the price reaches the limit. A buy order fills when the low of a bar reaches
+        the limit and a sell order when the high does, at the limit or at the open if the bar opens through it. Returns the order ID
 
-        ID = self._gen_order_ID()
+        inputs:
+        symbol (string): symbol (stock ticker, forex pair, etc.)
+        quantity (int): units of symbol to order, same sign convention as market_order
+        limit_price (float): highest price to buy at or lowest price to sell at'''
 
-        #creates new order dict
-        order = {'Order ID': ID,
-        'date of placement':self.datahandler.current_date,
-        'time of placement':self.datahandler._tob,
-        'order type':'market',
-        'symbol':symbol,
-        'quantity':quantity,
-        'desired execution time':time}
+        return self._place_resting_order(symbol,quantity,'limit',limit_price = limit_price)
 
-        #adds order to the pending order series. This is not the pending order dict. This is for history purposes
-        self._update_pending_order_series(order)
-        
-        #If/else chain handles whether order should be executed immediately or placed into the pending order dict
-        if order['desired execution time'] == 'open':
-            if order['time of placement'] == 'begin':
-                sym = order['symbol']
-                sym_open_data = self.datahandler._data_series[sym]['open']
-                execution_price = sym_open_data.loc[self.datahandler.current_date]
-                order.update({'execution price':execution_price, 'date of execution':self.datahandler.current_date,'execution side':'begin'})
-                self._update_order_series(order)
-                self._execute_order(order)
-                
-            elif order['time of placement'] == 'end':
-                self._update_pending_order_series(order)
-                most_recent_order = (self.pending_order_series.loc[self.datahandler.current_date])[-1]
-                self._add_pending_order(most_recent_order)
-                
-                
-        elif order['desired execution time'] == 'close':
-            if order['time of placement'] == 'end':
-                sym = order['symbol']
-                sym_close_data = self.datahandler._data_series[sym]['close']
-                execution_price = sym_close_data.loc[self.datahandler.current_date]
-                order.update({'execution price':execution_price, 'date of execution':self.datahandler.current_date,'execution side':'end'})
-                self._update_order_series(order)
-                self._execute_order(order)
-                
-            elif order['time of placement'] == 'begin':
-                self._update_pending_order_series(order)
-                most_recent_order = (self.pending_order_series.loc[self.datahandler.current_date])[-1]
-                self._add_pending_order(most_recent_order)
+    def stop_order(self,symbol,quantity,stop_price):
+
+        '''Places a stop order that rests until the price reaches the stop. A buy order fills when the high of a bar reaches
+        the stop and a sell order when the low does, at the stop or at the open if the bar opens through it. Returns the order ID
+
+        inputs:
+        symbol (string): symbol (stock ticker, forex pair, etc.)
+        quantity (int): units of symbol to order, same sign convention as market_order
+        stop_price (float): price that triggers the order'''
+
+        return self._place_resting_order(symbol,quantity,'stop',stop_price = stop_price)
+
+    def stop_limit_order(self,symbol,quantity,stop_price,limit_price):
+
+        '''Places a stop limit order that becomes a limit order when the price reaches the stop. On the bar the stop is
+        reached the order fills at the trigger price (the stop, or the open on a gap) if it is within the limit, otherwise
+        it rests as a limit order from the next bar. Returns the order ID
+
+        inputs:
+        symbol (string): symbol (stock ticker, forex pair, etc.)
+        quantity (int): units of symbol to order, same sign convention as market_order
+        stop_price (float): price that triggers the order
+        limit_price (float): highest price to buy at or lowest price to sell at once triggered'''
+
+        return self._place_resting_order(symbol,quantity,'stop limit',stop_price = stop_price,limit_price = limit_price)
+
+    def trailing_stop_order(self,symbol,quantity,trail_amount = None,trail_percent = None):
+
+        '''Places a stop order whose stop trails the best price since placement: the highest high for sell orders and the
+        lowest low for buy orders, starting from the current open or close. The stop is moved after each bar is checked.
+        Pass exactly one of trail_amount and trail_percent. Returns the order ID
+
+        inputs:
+        symbol (string): symbol (stock ticker, forex pair, etc.)
+        quantity (int): units of symbol to order, same sign convention as market_order
+        trail_amount (float): distance of the stop from the best price. Default is None
+        trail_percent (float): distance of the stop as a fraction of the best price, for example 0.05. Default is None'''
+
+        if (trail_amount is None) == (trail_percent is None):
+            raise ValueError('pass exactly one of trail_amount and trail_percent')
+        return self._place_resting_order(symbol,quantity,'trailing stop',trail_amount = trail_amount,trail_percent = trail_percent)
+
+    def cancel_order(self,ID):
+
+        '''Cancels a pending market order or a resting order that has not been executed
+
+        inputs:
+        ID (int): order ID'''
+
+        if ID in self.resting_orders:
+            self.resting_orders.remove(ID)
+        else:
+            self.pending_orders.remove(ID)
+
+    def market_orders(self,symbols,quantities,time):
+
+        '''Places market orders for several symbols at once. When the orders are executed immediately (see market_order) they
+        are priced and applied to the account as one batch: the cash movements of the whole batch are summed, with sales
+        applied before purchases, instead of being applied one order at a time. Every order is still recorded in the order log.
+        Orders that are executed later are placed in the pending orders like market_order does
+
+        inputs:
+        symbols (list): symbols to trade, each symbol at most once. Every symbol must be available
+        quantities (list or array): units of each symbol to order, same sign convention as market_order. Zero quantities are skipped
+        time (string): 'open' or 'close', determines time of bar the orders should be executed'''
+
+        if time not in ('open','close'):
+            raise ValueError("time must be 'open' or 'close'")
+        symbols = list(symbols)
+        quantities = np.asarray(quantities,dtype = np.float64)
+        if quantities.shape != (len(symbols),):
+            raise ValueError('pass one quantity per symbol')
+        if not np.isfinite(quantities).all():
+            raise ValueError('quantities must be finite')
+        if len(set(symbols)) != len(symbols):
+            raise ValueError('each symbol can only be ordered once per batch')
+
+        rows = np.array([self.datahandler._sym_to_row[symbol] for symbol in symbols],dtype = np.int64)
+        traded = quantities != 0
+        rows,quantities = rows[traded],quantities[traded]
+        unavailable = np.setdiff1d(rows,self.datahandler._available_rows)
+        if len(unavailable) > 0:
+            raise ValueError('symbols not available: '+str(list(self.datahandler._sym_array[unavailable])))
+
+        #creates the order records and adds them to the order log
+        tob = self.datahandler._tob
+        orders = [Order(self._gen_order_ID(),symbol,quantity,'market',time,self.datahandler._current_bar,tob,self.datahandler.date_index)
+                  for symbol,quantity in zip(self.datahandler._sym_array[rows].tolist(),quantities.tolist())]
+        for order in orders:
+            self.order_log.place(order)
+
+        if (time == 'open' and tob == 'begin') or (time == 'close' and tob == 'end'):
+            #prices the whole batch at once and applies it to the account
+            prices = self.datahandler._current_prices(time)[rows]
+            if self.cost_models:
+                prices = self._apply_costs(orders,prices,rows,quantities)
+            for order,price in zip(orders,prices.tolist()):
+                order.execution_price = price
+                order.execution_bar = self.datahandler._current_bar
+                order.execution_side = tob
+                self.order_log.fill(order)
+            self.account._update_account_with_orders(orders,rows,quantities,prices)
+        else:
+            for order in orders:
+                self._add_pending_order(order)
+
+    def rebalance_to(self,target_weights,time,whole_units = True):
+
+        '''Trades the portfolio to target weights with one market_orders batch. A weight is the fraction of the current
+        account value to hold in a symbol, negative for short positions. Held symbols without a weight are closed. Target
+        quantities are sized with the price of the current time of bar (the open at the beginning of the bar and the close
+        at the end of the bar)
+
+        inputs:
+        target_weights (dict or pandas series): weight of each symbol, keys are symbols. Symbols with a weight other than 0 must be available
+        time (string): 'open' or 'close', determines time of bar the orders should be executed
+        whole_units (bool): rounds target quantities toward zero to whole units. Default is True'''
+
+        target_weights = pd.Series(target_weights,dtype = np.float64)
+        target_weights = target_weights[target_weights != 0]
+        quantity = self.account._quantity
+        targets = np.zeros(len(quantity))
+        target_rows = np.array([self.datahandler._sym_to_row[symbol] for symbol in target_weights.index],dtype = np.int64)
+        unavailable = np.setdiff1d(target_rows,self.datahandler._available_rows)
+        if len(unavailable) > 0:
+            raise ValueError('symbols not available: '+str(list(self.datahandler._sym_array[unavailable])))
+
+        if self.datahandler._tob == 'begin':
+            prices = self.datahandler._current_prices('open')[target_rows]
+        else:
+            prices = self.datahandler._current_prices('close')[target_rows]
+        targets[target_rows] = target_weights.to_numpy()*self.account.equity['account value']/prices
+        if whole_units:
+            targets = np.trunc(targets)
+
+        #trades every symbol whose target differs from the current quantity, including held symbols without a weight
+        rows = np.flatnonzero(targets != quantity)
+        self.market_orders(self.datahandler._sym_array[rows].tolist(),targets[rows]-quantity[rows],time)
 
 class DataHandler:
 
     '''This class houses all methods used for adding data series before the backtest and 
     updating data series during the backtest'''
 
+    #the whole history of the data is held (in memory or memory mapped), so full per-symbol account history can be kept
+    _keeps_full_history = True
+
+    #attributes holding the data added to the data handler. These are read only during a backtest and can be shared
+    _data_attributes = ('_beginning_update_list','_data_series','strategy_start_date','strategy_end_date','sym_list',
+                        '_sym_to_row','date_index','_sym_array','_symbol_positions','_fields','_field_to_row','_prices',
+                        '_shared_dataset','_indicator_cache','_features')
+
     def __init__(self):
         #creates lists used for determining what time of bar a data series should be updated
         self.begin_data_list = []
@@ -699,6 +823,9 @@ class DataHandler:
         self.begin_data_series_list = []
         self.end_data_series_list = []
 
+        #finer grained bars used to fill resting orders within a bar, see use_intrabar_data
+        self._intrabar = None
+
     def _create_pointers(self,backtest):
         self.portfolio = backtest.portfolio
         self.execution = backtest.execution
@@ -711,7 +838,36 @@ class DataHandler:
         #creates bars to load variable, creates date iter object, and creates the tob (time of bar) variable
         self._bars_to_load = bars_to_load
         self._date_iter = iter(self.date_index)
+        self._current_bar = -1
         self._tob = 'end'
+        self._start_test(bars_to_load)
+
+    def _start_test(self,bars_to_load):
+        #resets the state of the data handler at the start of a backtest
+        self._create_availability_index(bars_to_load)
+
+    def _create_availability_index(self,bars_to_load):
+        #A symbol is available on a bar if it has data for that bar and at least bars_to_load bars of data up to that bar.
+        #Every bar from the symbol's bars_to_load-th bar onwards is available, so the available (bar, symbol row) pairs
+        #are sorted by bar and each bar's rows are sliced out with an offsets array
+        first_bar = max(bars_to_load-1,0)
+        bars = [positions[first_bar:] for positions in self._symbol_positions]
+        rows = [np.full(len(positions),row) for row,positions in enumerate(bars)]
+        bars = np.concatenate(bars) if bars else np.array([],dtype = np.int64)
+        rows = np.concatenate(rows) if rows else np.array([],dtype = np.int64)
+        order = np.argsort(bars,kind = 'stable')
+        self._availability_rows = rows[order]
+        self._availability_offsets = np.searchsorted(bars[order],np.arange(len(self.date_index)+1))
+
+    def _has_bar(self,rows):
+        #returns whether each symbol row has data for the current bar, whether or not the symbol is available yet
+        bar = self._current_bar
+        has_bar = np.zeros(len(rows),dtype = bool)
+        for i,row in enumerate(rows.tolist()):
+            positions = self._symbol_positions[row]
+            k = np.searchsorted(positions,bar)
+            has_bar[i] = k < len(positions) and positions[k] == bar
+        return has_bar
 
     def _update_time(self):
         if self._tob == 'end':
@@ -722,16 +878,11 @@ class DataHandler:
     def _update_date_symbols(self):
         #updates the current date and generates a list of symbols available for that date
         self.current_date = next(self._date_iter)
+        self._current_bar += 1
         if self.current_date >= self.strategy_start_date:
-            self.available_symbols = []
-            for sym in self.sym_list:
-                if self.current_date in self._data_series[sym].index:
-                    ###Find a less time consuming way to do this###
-                    temp_df = self._data_series[sym]
-                    amount_of_data = len(temp_df.index[temp_df.index <= self.current_date])
-                    if amount_of_data >=self._bars_to_load:
-                        self.available_symbols.append(sym)
-            self.available_symbols = tuple(self.available_symbols)
+            bar = self._current_bar
+            self._available_rows = self._availability_rows[self._availability_offsets[bar]:self._availability_offsets[bar+1]]
+            self.available_symbols = tuple(self._sym_array[self._available_rows])
 
     def add_data_series(self,series,beginning_update_list = []):
 
@@ -745,36 +896,358 @@ class DataHandler:
         time_to_update (string): must have value 'begin' or 'end'. Default is 'end'. Determines what time of bar this data 
         series will be updated'''
 
-        if 'open' not in beginning_update_list:
-            beginning_update_list.append('open')
+        #every symbol's bars must be in date order
+        series = pd.Series([dataframe if dataframe.index.is_monotonic_increasing else dataframe.sort_index() for dataframe in series],
+                           index = series.index,dtype = object)
 
-        self._beginning_update_list = beginning_update_list
+        #creates the date index from the dates of every symbol and the position of every bar of each symbol in it
+        date_index,symbol_positions = _merge_calendars([dataframe.index for dataframe in series])
 
+        #Creates a float64 array of shape (symbol, data type, bar) aligned to the date index. Bars where a symbol
+        #has no data are nan
+        fields = []
+        for dataframe in series:
+            fields = fields + [field for field in dataframe.columns if field not in fields]
+        prices = np.full((len(series),len(fields),len(date_index)),np.nan)
+        for row,dataframe in enumerate(series):
+            prices[row][:,symbol_positions[row]] = dataframe.reindex(columns = fields).to_numpy(dtype = np.float64).T
+
+        self._load_arrays(date_index,list(series.index),fields,prices,symbol_positions,beginning_update_list)
         self._data_series = series
 
-        #creates symbol list, start date, end date, and date index variables from the close series
-        self.strategy_start_date = min([series.index[0] for series in self._data_series])
-        self.strategy_end_date = max([series.index[-1] for series in self._data_series])
-        self.sym_list = list(self._data_series.index)
-        self.date_index = pd.Index([])
-        for dataframe in self._data_series:
-            self.date_index = self.date_index.append(dataframe.index)
-        self.date_index = self.date_index.unique()
+    def attach_shared_data(self,name):
+
+        '''Uses a dataset placed in shared memory by SharedDataset instead of adding data series. The price data is read directly
+        from the shared memory, so any number of processes can attach to the same dataset without copying it
+
+        inputs:
+        name (string): name of the shared dataset'''
+
+        dataset = SharedDataset.attach(name)
+        self._load_arrays(dataset.date_index,dataset.sym_list,dataset.fields,dataset.prices,dataset.symbol_positions,
+                          dataset.beginning_update_list)
+        self._data_series = None
+        #keeps the shared memory open for as long as the data handler uses it
+        self._shared_dataset = dataset
+
+    def save_dataset(self,path):
+
+        '''Saves the data of the data handler as a dataset that load_dataset can open. See backtest.dataset for the format
+
+        inputs:
+        path (file path): directory to save the dataset to'''
+
+        dataset.write_dataset(path,self.date_index,self.sym_list,self._fields,self._prices,self._symbol_positions,
+                              self._beginning_update_list)
+
+    def load_dataset(self,path,beginning_update_list = None,mmap = True):
+
+        '''Uses a dataset saved by save_dataset instead of adding data series. The arrays are memory mapped, so only the data
+        that is read is loaded from disk
+
+        inputs:
+        path (file path): directory of the dataset
+        beginning_update_list (list): overrides the beginning update list saved with the dataset. Default is None
+        mmap (bool): memory maps the dataset instead of reading it into memory. Default is True'''
+
+        arrays = dataset.read_dataset(path,mmap)
+        if beginning_update_list is None:
+            beginning_update_list = arrays['beginning_update_list']
+        self._load_arrays(arrays['date_index'],arrays['sym_list'],arrays['fields'],arrays['prices'],arrays['symbol_positions'],
+                          beginning_update_list)
+        self._data_series = None
+
+    def use_intrabar_data(self,path,cache_size = 4096):
+
+        '''Fills resting orders (limit, stop, stop limit and trailing stop orders) at the first sub-bar of a finer grained
+        dataset that reaches them, instead of at the bar's open, high and low. The dataset is opened the first time an order
+        may fill, and only the sub-bars of the symbols and bars orders may fill on are read from disk. Market orders still
+        fill at the open or close. Pass None to stop using intrabar data
+
+        inputs:
+        path (file path): directory of a dataset saved by save_dataset with 'open', 'high' and 'low' data of the sub-bars,
+        for example 1 minute bars of the symbols of a daily backtest
+        cache_size (int): number of (symbol, bar) pairs of sub-bars kept in memory. Default is 4096'''
+
+        self._intrabar = None if path is None else IntrabarData(path,cache_size)
+
+    def _load_arrays(self,date_index,sym_list,fields,prices,symbol_positions,beginning_update_list):
+        #Sets the data of the data handler. date_index must be sorted, prices is a float64 array of shape (symbol, data type, bar)
+        #whose rows follow sym_list and fields, and symbol_positions holds the sorted positions of every bar of each symbol in the date index
+        beginning_update_list = list(beginning_update_list)
+        if 'open' not in beginning_update_list:
+            beginning_update_list.append('open')
+        self._beginning_update_list = beginning_update_list
+
+        self.date_index = date_index
+        self.strategy_start_date = date_index[0]
+        self.strategy_end_date = date_index[-1]
+
+        self.sym_list = list(sym_list)
+        self._sym_to_row = {sym:i for i,sym in enumerate(self.sym_list)}
+        self._sym_array = np.array(self.sym_list,dtype = object)
+        self._symbol_positions = symbol_positions
+
+        self._fields = list(fields)
+        self._field_to_row = {field:i for i,field in enumerate(self._fields)}
+        self._prices = prices
+        #views handed out by data_view must not be able to change the data
+        self._prices.flags.writeable = False
+        self._shared_dataset = None
+        #indicators computed on this data, see indicator
+        self._indicator_cache = {}
+        #features computed on this data, see add_feature
+        self._features = {}
+
+    def _current_prices(self,data_type):
+        #returns the price of data_type for the current bar of every symbol, ordered by symbol row
+        return self._prices[:,self._field_to_row[data_type],self._current_bar]
+
+    def _current_price(self,symbol,data_type):
+        #returns the price of data_type for the current bar of a symbol
+        return self._prices[self._sym_to_row[symbol],self._field_to_row[data_type],self._current_bar]
+
+    def _field_array(self,data_type):
+        #returns a read only view of one data type of every symbol on every bar, of shape (symbol row, bar)
+        return self._prices[:,self._field_to_row[data_type],:]
+
+    def _field_frame(self,data_type):
+        #creates a dataframe of one data type for every symbol aligned to the date index
+        return pd.DataFrame(self._field_array(data_type).T,index = self.date_index,columns = self.sym_list)
+
+    def _share_data(self,datahandler):
+        #uses the data of another data handler without copying it
+        for attribute in self._data_attributes:
+            setattr(self,attribute,getattr(datahandler,attribute))
 
     def data(self,symbol,data_type,number_of_bars):
         if number_of_bars > self._bars_to_load:
             raise ValueError('number_of_bars exceeds the specified bars to load')
 
-        temp_slice = self._data_series[symbol][data_type]
-        current_date_location = temp_slice.index.get_loc(self.current_date)
+        #positions in the date index of the symbol's bars, the symbol must have data for the current bar
+        row = self._sym_to_row[symbol]
+        positions = self._symbol_positions[row]
+        current_date_location = int(np.searchsorted(positions,self._current_bar))
+        if current_date_location == len(positions) or positions[current_date_location] != self._current_bar:
+            raise KeyError(self.current_date)
+
         start_location = current_date_location+1-number_of_bars
         if self._tob == 'begin' and data_type in self._beginning_update_list:
-            temp_slice = temp_slice[start_location:current_date_location+1]
+            positions = positions[start_location:current_date_location+1]
         elif self._tob == 'begin' and data_type not in self._beginning_update_list:
-            temp_slice = temp_slice[start_location-1:current_date_location]
+            positions = positions[start_location-1:current_date_location]
         elif self._tob == 'end':
-            temp_slice = temp_slice[start_location:current_date_location+1]
-        return temp_slice
+            positions = positions[start_location:current_date_location+1]
+        return pd.Series(self._prices[row,self._field_to_row[data_type],positions],index = self.date_index[positions],name = data_type)
+
+    def _window_stop(self,data_type):
+        #returns the position after the last bar of data_type that can be seen at the current time of bar. At the beginning
+        #of a bar only data types in the beginning update list include the current bar
+        if self._tob == 'begin' and data_type not in self._beginning_update_list:
+            return self._current_bar
+        return self._current_bar+1
+
+    def data_view(self,symbol,data_type,number_of_bars):
+
+        '''Fast version of the data method. Returns a read only numpy view of the last number_of_bars bars of data_type
+        for a symbol. The view is taken from the price cube, so bars are bars of the date index and bars where
+        the symbol has no data are nan. Follows the same beginning/end of bar rules as the data method
+
+        inputs:
+        symbol (string): symbol to return data for
+        data_type (string): data type to return, for example 'open' or 'close'
+        number_of_bars (int): number of bars to return'''
+
+        if number_of_bars > self._bars_to_load:
+            raise ValueError('number_of_bars exceeds the specified bars to load')
+
+        stop = self._window_stop(data_type)
+        return self._prices[self._sym_to_row[symbol],self._field_to_row[data_type],max(stop-number_of_bars,0):stop]
+
+    def data_views(self,data_type,number_of_bars,symbols = None):
+
+        '''Batched version of data_view. Returns a 2-D numpy array with one row per symbol and one column per bar.
+        When symbols is None the result is a read only view of every symbol in sym_list order. When a list of symbols is
+        passed, their rows are gathered into a new array in the order given
+
+        inputs:
+        data_type (string): data type to return, for example 'open' or 'close'
+        number_of_bars (int): number of bars to return
+        symbols (list): symbols to return data for. Default is None (every symbol)'''
+
+        if number_of_bars > self._bars_to_load:
+            raise ValueError('number_of_bars exceeds the specified bars to load')
+
+        stop = self._window_stop(data_type)
+        window = self._prices[:,self._field_to_row[data_type],max(stop-number_of_bars,0):stop]
+        if symbols is None:
+            return window
+        return window[[self._sym_to_row[sym] for sym in symbols]]
+
+    def add_indicator(self,name,period,data_type = 'close'):
+
+        '''Computes an indicator for every symbol over the whole history before the backtest. Indicators that are not added
+        are computed for each symbol the first time they are requested, so adding them is optional
+
+        inputs:
+        name (string): name of the indicator in backtest.indicators.INDICATORS: 'SMA', 'EMA', 'STD', 'RSI', 'ATR', 'MAX' or 'MIN'
+        period (int): number of bars of the indicator
+        data_type (string): data type the indicator is computed from. Not used by 'ATR', which uses the high, low and close.
+        Default is 'close' '''
+
+        self._indicator_values(indicator_key(name,period,data_type),np.arange(len(self.sym_list)))
+
+    def _indicator_values(self,key,rows):
+        #Returns the values of an indicator for every symbol and bar, computing the rows that have not been computed yet with
+        #vectorized operations over each symbol's whole history. Each value is kept until the symbol's next bar. The values
+        #are cached with the data, so backtests that share the data handler or its data share them
+        entry = self._indicator_cache.get(key)
+        if entry is None:
+            entry = self._indicator_cache[key] = (np.full((len(self.sym_list),len(self.date_index)),np.nan),
+                                                  np.zeros(len(self.sym_list),dtype = bool))
+        values,computed = entry
+        missing = rows[~computed[rows]]
+        if len(missing) > 0:
+            name,fields,period = key
+            indicator = INDICATORS[name](period)
+            field_rows = [self._field_to_row[field] for field in fields]
+            for row in missing.tolist():
+                positions = np.asarray(self._symbol_positions[row])
+                if len(positions) == 0:
+                    continue
+                result = indicator.compute(*[np.asarray(self._prices[row,field_row,positions]) for field_row in field_rows])
+                values[row,positions[0]:] = np.repeat(result,np.diff(np.append(positions,len(self.date_index))))
+            computed[missing] = True
+        return values
+
+    def _indicator_lookup(self,key,rows):
+        #returns the values of an indicator for rows that can be seen at the current time of bar. At the beginning of a bar
+        #indicators of data types that are not in the beginning update list have the value of the previous bar
+        values = self._indicator_values(key,rows)
+        bar = self._current_bar
+        if self._tob == 'begin' and not all(field in self._beginning_update_list for field in key[1]):
+            bar -= 1
+        if bar < 0:
+            return np.full(len(rows),np.nan)
+        return values[rows,bar]
+
+    def indicator(self,symbol,name,period,data_type = 'close'):
+
+        '''Returns the value of an indicator for a symbol at the current time of bar. Indicators are computed once for each
+        symbol, data type and period and cached, so every strategy and backtest using the data handler shares them. Indicators
+        are computed over the bars the symbol has data for, and a symbol without data on the current bar has the value of its
+        last bar. Follows the beginning/end of bar rules of the data method: at the beginning of a bar an indicator of data
+        types that are not updated at the beginning of the bar (for example the close) has the value of the previous bar
+
+        inputs:
+        symbol (string): symbol to return the indicator for
+        name (string): name of the indicator in backtest.indicators.INDICATORS: 'SMA', 'EMA', 'STD', 'RSI', 'ATR', 'MAX' or 'MIN'
+        period (int): number of bars of the indicator
+        data_type (string): data type the indicator is computed from. Not used by 'ATR'. Default is 'close' '''
+
+        return self._indicator_lookup(indicator_key(name,period,data_type),np.array([self._sym_to_row[symbol]]))[0]
+
+    def indicators(self,name,period,data_type = 'close',symbols = None):
+
+        '''Batched version of indicator. Returns a numpy array with the indicator of every symbol in sym_list order, or of
+        symbols in the order given
+
+        inputs:
+        name (string): name of the indicator
+        period (int): number of bars of the indicator
+        data_type (string): data type the indicator is computed from. Default is 'close'
+        symbols (list): symbols to return the indicator for. Default is None (every symbol)'''
+
+        if symbols is None:
+            rows = np.arange(len(self.sym_list))
+        else:
+            rows = np.array([self._sym_to_row[sym] for sym in symbols],dtype = np.int64)
+        return self._indicator_lookup(indicator_key(name,period,data_type),rows)
+
+    def add_feature(self,name,function,inputs):
+
+        '''Declares a derived series and computes it for every symbol over the whole calendar at once. function is called once
+        with a dataframe of each input, indexed by the date index with a column per symbol (NaN where a symbol has no data),
+        and returns a dataframe or array of the same shape. The result is stored aligned to the price cube and is read during
+        the backtest with feature, features, feature_view and feature_views, which apply the beginning/end of bar rules of
+        the data method: at the beginning of a bar, a feature of any input that is not updated at the beginning of the bar
+        can only be read up to the previous bar. function must only use each date's value and the values before it, for
+        example with rolling, ewm or shift with a positive number of periods
+
+        inputs:
+        name (string): name of the feature
+        function (function): takes one dataframe per input and returns the feature
+        inputs (list): data types and names of features added before, for example ['close'] or ['high','low','close']'''
+
+        fields = []
+        frames = []
+        for source in inputs:
+            if source in self._features:
+                feature = self._features[source]
+                fields.extend(feature.fields)
+                frames.append(pd.DataFrame(feature.values.T,index = self.date_index,columns = self.sym_list))
+            else:
+                fields.append(source)
+                frames.append(self._field_frame(source))
+
+        result = function(*frames)
+        if isinstance(result,pd.DataFrame):
+            result = result.reindex(index = self.date_index,columns = self.sym_list)
+        values = np.asarray(result,dtype = np.float64)
+        if values.shape != (len(self.date_index),len(self.sym_list)):
+            raise ValueError('feature '+repr(name)+' must have one row per date and one column per symbol')
+        self._features[name] = Feature(name,values.T,dict.fromkeys(fields),self._beginning_update_list)
+
+    def feature(self,name,symbol):
+
+        '''Returns the value of a feature for a symbol that can be seen at the current time of bar
+
+        inputs:
+        name (string): name of the feature
+        symbol (string): symbol to return the feature for'''
+
+        return self._features[name].current(self._current_bar,self._tob)[self._sym_to_row[symbol]]
+
+    def features(self,name,symbols = None):
+
+        '''Batched version of feature. Returns the value of a feature that can be seen at the current time of bar for every
+        symbol in sym_list order (a read only view), or for symbols in the order given
+
+        inputs:
+        name (string): name of the feature
+        symbols (list): symbols to return the feature for. Default is None (every symbol)'''
+
+        values = self._features[name].current(self._current_bar,self._tob)
+        if symbols is None:
+            return values
+        return values[[self._sym_to_row[sym] for sym in symbols]]
+
+    def feature_view(self,name,symbol,number_of_bars):
+
+        '''Returns a read only numpy view of the last number_of_bars values of a feature for a symbol that can be seen at the
+        current time of bar. Like data_view, bars are bars of the date index
+
+        inputs:
+        name (string): name of the feature
+        symbol (string): symbol to return the feature for
+        number_of_bars (int): number of bars to return'''
+
+        return self._features[name].window(self._current_bar,self._tob,number_of_bars)[self._sym_to_row[symbol]]
+
+    def feature_views(self,name,number_of_bars,symbols = None):
+
+        '''Batched version of feature_view. Returns a 2-D numpy array with one row per symbol and one column per bar, a read
+        only view of every symbol in sym_list order when symbols is None
+
+        inputs:
+        name (string): name of the feature
+        number_of_bars (int): number of bars to return
+        symbols (list): symbols to return the feature for. Default is None (every symbol)'''
+
+        window = self._features[name].window(self._current_bar,self._tob,number_of_bars)
+        if symbols is None:
+            return window
+        return window[[self._sym_to_row[sym] for sym in symbols]]
 
 class Backtest:
 
@@ -791,6 +1264,10 @@ class Backtest:
         self.analysis = analysis()
         self.account = account()
 
+        self._create_pointers()
+
+    def _create_pointers(self):
+        #links every component of the backtest to the others
         self.strategy._create_pointers(self)
         self.portfolio._create_pointers(self)
         self.datahandler._create_pointers(self)
@@ -798,92 +1275,146 @@ class Backtest:
         self.analysis._create_pointers(self)
         self.account._create_pointers(self)
 
-    def test_strategy(self,bars_to_load,cash = 100000):
+    def test_strategy(self,bars_to_load,cash = 100000,progress_bar = True,profile = False):
 
         '''tests the strategy
 
         inputs:
         bars_to_load (int): number of data bars to load at a time during the backtest. Usually the amount of data required for the longest indicator
-        cash (float): amount of cash to start the test with. Default is 100,000'''
+        cash (float): amount of cash to start the test with. Default is 100,000
+        progress_bar (bool): shows a progress bar while the backtest runs. Default is True
+        profile (bool): times each phase of the bar and counts orders, fills and data calls. The ProfileReport is saved as
+            self.profile_report. Default is False'''
 
         #creates the date iter object        
         self.datahandler._create_date_iter(bars_to_load)
 
+        #resets the account, pending orders and history
+        self._reset_test(cash)
+
+        profiler = None
+        if profile:
+            profiler = Profiler(self)
+            profiler.start()
+
+        try:
+            #main loop of backtester
+            ###Improve this with an apply method###
+            for i in tqdm(range(len(self.datahandler.date_index)),disable = not progress_bar):
+                #updates the current date and list of available symbols
+                self.datahandler._update_date_symbols() 
+                #updates data series at beginning of bar
+                self.datahandler._update_time()
+                #runs the beginning of bar
+                self._run_bar_begin()
+                #updates data series at end of bar
+                self.datahandler._update_time()
+                #runs the end of bar
+                self._run_bar_end()
+        finally:
+            if profiler is not None:
+                self.profile_report = profiler.stop()
+
+    def _reset_test(self,cash):
+        #resets everything other than the data handler before a test
+
         #resets the account
         self.account._reset_account(cash)
         
         #clears any pending orders
         self.execution._clear_pending_orders()
 
-        #creates execution order series for history purposes
-        self.execution.order_series = pd.Series([('No orders',) for x in range(len(self.datahandler.date_index))], index = self.datahandler.date_index)
-        
-        #creates execution pending order series for history purposes
-        self.execution.pending_order_series = pd.Series([('No pending orders',) for x in range(len(self.datahandler.date_index))],index = self.datahandler.date_index)
-
-        #main loop of backtester
-        ###Improve this with an apply method###
-        for i in tqdm(range(len(self.datahandler.date_index))):
-            #updates the current date and list of available symbols
-            self.datahandler._update_date_symbols() 
-            #removes delisted securities from account and pending orders
-            self.account._remove_delisted_securities()
-            #updates data series at beginning of bar
-            self.datahandler._update_time()
-            #updates the account to reflect new data
-            self.account._update_account_begin()
-            if self.datahandler.current_date>self.datahandler.strategy_start_date:
-                #current date is past strategy start date so the strategy has enough data to begin
-                #executes pending orders if necessary
-                self.execution._scan_and_execute_pending_orders()
-                #executes logic at the beginning of bar
-                self.strategy.strategy_logic_begin()
-                #executes pending orders if necessary
-                self.execution._scan_and_execute_pending_orders()
-            #updates data series at end of bar
-            self.datahandler._update_time()
-            #updates account to reflect new data
-            self.account._update_account_end()
-            if self.datahandler.current_date>self.datahandler.strategy_start_date: ####think about implications of > vs >=###
-                #executes pending orders if necessary
-                self.execution._scan_and_execute_pending_orders()
-                #executes strategy logic at end of bar
-                self.strategy.strategy_logic_end()
-                #executes pending orders if necessary
-                self.execution._scan_and_execute_pending_orders()
-            #updates the account history and results dataframes
-            self.account._update_account_history_and_results()
-            #runs the analyze function is there is data or metrics that the user wants to calculate/log
-            self.analysis.analyze()
-
-    def _optimize_strategy(self,bars_to_load, val1,val2,cash = 100000):
-
-        '''Has not been fully tested'''
+        #resets the metrics kept during the backtest
+        self.analysis._reset_running_metrics()
+
+        #creates the order log the order series are built from
+        self.execution.order_log = OrderLog(self.datahandler.date_index)
+
+    def _run_bar_begin(self):
+        #runs the beginning of the current bar, the data handler must already be at the beginning of the bar
+
+        #removes delisted securities from account and pending orders
+        self.account._remove_delisted_securities()
+        #updates the account to reflect new data
+        self.account._update_account_begin()
+        if self.datahandler.current_date>self.datahandler.strategy_start_date:
+            #current date is past strategy start date so the strategy has enough data to begin
+            #executes pending orders if necessary
+            self.execution._scan_and_execute_pending_orders()
+            #executes logic at the beginning of bar
+            self.strategy.strategy_logic_begin()
+            #executes pending orders if necessary
+            self.execution._scan_and_execute_pending_orders()
+
+    def _run_bar_end(self):
+        #runs the end of the current bar, the data handler must already be at the end of the bar
+
+        #fills resting orders triggered during the bar before the account is marked at the close
+        self.execution._match_resting_orders()
+        #updates account to reflect new data
+        self.account._update_account_end()
+        if self.datahandler.current_date>self.datahandler.strategy_start_date: ####think about implications of > vs >=###
+            #executes pending orders if necessary
+            self.execution._scan_and_execute_pending_orders()
+            #executes strategy logic at end of bar
+            self.strategy.strategy_logic_end()
+            #executes pending orders if necessary
+            self.execution._scan_and_execute_pending_orders()
+        #updates the account history and results dataframes
+        self.account._update_account_history_and_results()
+        #updates the running metrics and runs the analyze function is there is data or metrics that the user wants to calculate/log
+        self.analysis._update_running_metrics()
+        self.analysis.analyze()
+
+class MultiBacktest:
+
+    '''Tests several strategies on the same data in one pass. One data handler advances the date and available symbols once per bar
+    and every strategy runs on its own account, execution, portfolio and analysis. The backtest of each strategy is in the
+    backtests list in the order the strategies were passed'''
+
+    def __init__(self,strategies,portfolio = Portfolio,
+                 execution = Execution, datahandler = DataHandler,
+                 analysis = Analysis, account = Account):
 
-        self.datahandler._create_date_iter(bars_to_load)
+        '''inputs:
+        strategies (list): strategy classes to test. An item can also be a (strategy class, parameters dict) tuple, in which case
+            each parameter is set as an attribute of that strategy instance like Optimize.parameter_sweep does
+        portfolio, execution, datahandler, analysis, account (classes): same as Backtest, used for every strategy'''
 
-        self.account._reset_account(cash)
-        
-        self.execution._clear_pending_orders()
+        self.datahandler = datahandler()
+        self.backtests = []
+        for strategy in strategies:
+            parameters = {}
+            if isinstance(strategy,tuple):
+                strategy,parameters = strategy
+            backtest = Backtest(strategy = strategy,portfolio = portfolio,execution = execution,
+                                datahandler = datahandler,analysis = analysis,account = account)
+            for name in parameters:
+                setattr(backtest.strategy,name,parameters[name])
+            #every backtest uses the shared data handler
+            backtest.datahandler = self.datahandler
+            backtest._create_pointers()
+            self.backtests.append(backtest)
+
+    def test_strategies(self,bars_to_load,cash = 100000,progress_bar = True):
+
+        '''tests every strategy
 
-        self.execution.order_series = pd.Series([('No orders',) for x in range(len(self.datahandler.date_index))], index = self.datahandler.date_index)
-        
-        self.execution.pending_order_series = pd.Series([('No pending orders',) for x in range(len(self.datahandler.date_index))],index = self.datahandler.date_index)
-
-        for i in tqdm(range(len(self.datahandler.date_index))):
-            self.datahandler._update_date_symbols() #updates the current date and list of available symbols
-            self.account._remove_delisted_securities()
-            self.datahandler._update_begin_bar_data() #updates only open data for current date, allows for begin of bar trading
-            self.account._update_account_begin()
-            if self.datahandler.current_date>self.datahandler.strategy_start_date:
-                self.execution._scan_and_execute_pending_orders()
-                self.strategy.strategy_logic_begin()
-                self.execution._scan_and_execute_pending_orders()
-            self.datahandler._update_end_bar_data()
-            self.account._update_account_end()
-            if self.datahandler.current_date>self.datahandler.strategy_start_date: #think about implications of > vs >=
-                self.execution._scan_and_execute_pending_orders()
-                self.strategy.strategy_logic_end()
-                self.execution._scan_and_execute_pending_orders()
-            self.account._update_account_history_and_results()
-            self.analysis.analyze()
\ No newline at end of file
+        inputs:
+        bars_to_load (int): number of data bars to load at a time during the backtest. Usually the amount of data required for the longest indicator
+        cash (float): amount of cash each strategy starts with. Default is 100,000
+        progress_bar (bool): shows a progress bar while the backtests run. Default is True'''
+
+        self.datahandler._create_date_iter(bars_to_load)
+        for backtest in self.backtests:
+            backtest._reset_test(cash)
+
+        for i in tqdm(range(len(self.datahandler.date_index)),disable = not progress_bar):
+            #the date, available symbols and time of bar are updated once for every strategy
+            self.datahandler._update_date_symbols()
+            self.datahandler._update_time()
+            for backtest in self.backtests:
+                backtest._run_bar_begin()
+            self.datahandler._update_time()
+            for backtest in self.backtests:
+                backtest._run_bar_end()
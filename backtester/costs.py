@@ -0,0 +1,130 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+
+#Trading cost models used by Execution. Every model computes the costs of a whole batch of fills (every order filled
+#together on a bar) with array operations and returns one cost per fill in currency. Slippage costs move the fill price
+#against the order, commission costs are paid from cash when the order is executed. Set the models on an Execution
+#subclass, for example
+#
+#   class MyExecution(Execution):
+#       cost_models = (PerShareCommission(0.005,minimum = 1),SpreadSlippage(spread = 0.0005),SquareRootImpact(0.1))
+
+class CostModel:
+
+    '''Base class of the cost models. Subclasses set kind and implement costs'''
+
+    #'commission' for costs paid from cash, 'slippage' for costs that move the fill price
+    kind = 'commission'
+
+    def costs(self,quantities,prices,rows,datahandler):
+
+        '''Returns the cost in currency of every fill of a batch as a numpy array
+
+        inputs:
+        quantities (array): signed units of every fill
+        prices (array): price of every fill before slippage
+        rows (array): symbol row of every fill
+        datahandler (DataHandler): data handler of the backtest, at the bar and time of bar of the fills'''
+
+        raise NotImplementedError
+
+class FixedCommission(CostModel):
+
+    '''Commission of a fixed amount per order'''
+
+    def __init__(self,amount):
+
+        '''inputs:
+        amount (float): commission of every order'''
+
+        self.amount = amount
+
+    def costs(self,quantities,prices,rows,datahandler):
+        return np.full(len(quantities),float(self.amount))
+
+class PerShareCommission(CostModel):
+
+    '''Commission per unit traded, with an optional minimum per order'''
+
+    def __init__(self,rate,minimum = 0.0):
+
+        '''inputs:
+        rate (float): commission per unit
+        minimum (float): lowest commission of an order. Default is 0'''
+
+        self.rate = rate
+        self.minimum = minimum
+
+    def costs(self,quantities,prices,rows,datahandler):
+        return np.maximum(np.abs(quantities)*self.rate,self.minimum)
+
+class BpsSlippage(CostModel):
+
+    '''Slippage of a fixed number of basis points of the traded value'''
+
+    kind = 'slippage'
+
+    def __init__(self,bps):
+
+        '''inputs:
+        bps (float): slippage in basis points, for example 5 for 0.05%'''
+
+        self.bps = bps
+
+    def costs(self,quantities,prices,rows,datahandler):
+        return np.abs(quantities)*prices*(self.bps/10000)
+
+class SpreadSlippage(CostModel):
+
+    '''Slippage of half the bid ask spread per unit. The spread is either a fixed fraction of the price or read from a data
+    type of the data handler holding the spread in price units. A data type is read for the last bar that can be seen at
+    the time of the fill, so it needs bars_to_load of at least 1'''
+
+    kind = 'slippage'
+
+    def __init__(self,spread = None,field = None):
+
+        '''inputs:
+        spread (float): spread as a fraction of the price, for example 0.001. Default is None
+        field (string): data type holding the spread, for example 'spread'. Default is None'''
+
+        if (spread is None) == (field is None):
+            raise ValueError('pass exactly one of spread and field')
+        self.spread = spread
+        self.field = field
+
+    def costs(self,quantities,prices,rows,datahandler):
+        if self.field is None:
+            spread = prices*self.spread
+        else:
+            spread = datahandler.data_views(self.field,1)[rows,-1]
+        return np.abs(quantities)*np.nan_to_num(spread)/2
+
+class SquareRootImpact(CostModel):
+
+    '''Market impact that grows with the square root of the order's share of the average volume: the fill price moves
+    against the order by coefficient*sqrt(|quantity|/average volume) of the price. The average volume is taken over the
+    last window bars that can be seen at the time of the fill (so fills at the open do not use the bar's own volume) and
+    needs bars_to_load of at least window. Symbols without volume in the window have no impact'''
+
+    kind = 'slippage'
+
+    def __init__(self,coefficient = 0.1,window = 20,volume_field = 'volume'):
+
+        '''inputs:
+        coefficient (float): impact as a fraction of the price when an order is the whole average volume. Default is 0.1
+        window (int): number of bars the average volume is taken over. Default is 20
+        volume_field (string): data type holding the volume. Default is 'volume' '''
+
+        self.coefficient = coefficient
+        self.window = window
+        self.volume_field = volume_field
+
+    def costs(self,quantities,prices,rows,datahandler):
+        volumes = datahandler.data_views(self.volume_field,self.window)[rows]
+        seen = ~np.isnan(volumes)
+        counts = seen.sum(axis = 1)
+        average = np.where(seen,volumes,0).sum(axis = 1)/np.maximum(counts,1)
+        units = np.abs(quantities)
+        share = np.divide(units,average,out = np.zeros(len(units)),where = average > 0)
+        return units*prices*self.coefficient*np.sqrt(share)
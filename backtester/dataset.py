@@ -0,0 +1,118 @@
+'''Author: Jacob Atnip'''
+import json
+import os
+import numpy as np
+import pandas as pd
+
+#On disk dataset format read by DataHandler.load_dataset. A dataset is a directory holding:
+#   prices.npy      float64 array of shape (symbol, data type, bar) aligned to the calendar, nan where a symbol has no data
+#   dates.npy       calendar, the sorted date of every bar. Datetime calendars are stored as int64 UTC nanoseconds
+#   positions.npy   position in the calendar of every bar of every symbol, one symbol after the other
+#   offsets.npy     start of each symbol's positions in positions.npy, with the total count at the end
+#   metadata.json   symbol table, data types, beginning update list and the time zone of a datetime calendar
+#Arrays are opened memory mapped, so loading is near instant and only the pages that are read are brought into memory
+
+FORMAT_VERSION = 2
+
+def _pack_positions(symbol_positions):
+    #packs a list of position arrays into one int64 array and an offsets array
+    offsets = np.zeros(len(symbol_positions)+1,dtype = np.int64)
+    offsets[1:] = np.cumsum([len(positions) for positions in symbol_positions])
+    if len(symbol_positions) == 0:
+        return np.array([],dtype = np.int64),offsets
+    return np.concatenate([np.asarray(positions,dtype = np.int64) for positions in symbol_positions]),offsets
+
+def _unpack_positions(positions,offsets):
+    #returns a view of each symbol's positions
+    return [positions[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+def _encode_dates(date_index):
+    #returns the calendar as a fixed width array and a description of it to store in the metadata. Datetime calendars,
+    #including time zone aware ones, are stored as int64 UTC nanoseconds with their time zone
+    if isinstance(date_index,pd.DatetimeIndex):
+        tz = date_index.tz
+        return np.asarray(date_index.as_unit('ns').asi8,dtype = np.int64),{'kind':'datetime','tz':None if tz is None else str(tz)}
+    dates = np.asarray(date_index)
+    if dates.dtype == object:
+        raise ValueError('the date index must be a datetime index or have a fixed width dtype to be saved')
+    return dates,{'kind':'array'}
+
+def _decode_dates(dates,description):
+    #returns the calendar stored by _encode_dates
+    if description['kind'] == 'datetime':
+        date_index = pd.DatetimeIndex(np.asarray(dates,dtype = np.int64).view('datetime64[ns]'))
+        if description['tz'] is not None:
+            date_index = date_index.tz_localize('UTC').tz_convert(description['tz'])
+        return date_index
+    return pd.Index(dates)
+
+def _encode_symbols(sym_list):
+    #returns the symbols as values that keep their type through json. Only strings and integers are supported
+    symbols = []
+    for sym in sym_list:
+        if isinstance(sym,str):
+            symbols.append(sym)
+        elif isinstance(sym,(int,np.integer)) and not isinstance(sym,(bool,np.bool_)):
+            symbols.append(int(sym))
+        else:
+            raise ValueError('symbols must be strings or integers to be saved, got '+repr(sym))
+    return symbols
+
+def write_dataset(path,date_index,sym_list,fields,prices,symbol_positions,beginning_update_list = ()):
+
+    '''Writes a dataset to the directory path, creating it if necessary
+
+    inputs:
+    path (file path): directory to write the dataset to
+    date_index (pandas index): sorted calendar of the dataset
+    sym_list (list): symbol table, in the order of the first axis of prices. Symbols must be strings or integers
+    fields (list): data types, in the order of the second axis of prices
+    prices (numpy array): float64 array of shape (symbol, data type, bar)
+    symbol_positions (list): sorted positions in the calendar of every bar of each symbol
+    beginning_update_list (list): data types updated at the beginning of the bar'''
+
+    dates,date_description = _encode_dates(date_index)
+    symbols = _encode_symbols(sym_list)
+
+    os.makedirs(path,exist_ok = True)
+    positions,offsets = _pack_positions(symbol_positions)
+    np.save(os.path.join(path,'prices.npy'),np.asarray(prices,dtype = np.float64))
+    np.save(os.path.join(path,'dates.npy'),dates)
+    np.save(os.path.join(path,'positions.npy'),positions)
+    np.save(os.path.join(path,'offsets.npy'),offsets)
+
+    metadata = {'format version':FORMAT_VERSION,
+                'symbols':symbols,
+                'dates':date_description,
+                'fields':[str(field) for field in fields],
+                'beginning update list':list(beginning_update_list)}
+    with open(os.path.join(path,'metadata.json'),'w') as file:
+        json.dump(metadata,file)
+
+def read_dataset(path,mmap = True):
+
+    '''Opens a dataset written by write_dataset and returns a dictionary with the keys 'date_index', 'sym_list', 'fields',
+    'prices', 'symbol_positions' and 'beginning_update_list'
+
+    inputs:
+    path (file path): directory of the dataset
+    mmap (bool): memory maps the arrays instead of reading them into memory. Default is True'''
+
+    with open(os.path.join(path,'metadata.json')) as file:
+        metadata = json.load(file)
+    if metadata['format version'] > FORMAT_VERSION:
+        raise ValueError('dataset was written by a newer version of the backtester')
+
+    mmap_mode = 'r' if mmap else None
+    prices = np.load(os.path.join(path,'prices.npy'),mmap_mode = mmap_mode)
+    positions = np.load(os.path.join(path,'positions.npy'),mmap_mode = mmap_mode)
+    offsets = np.load(os.path.join(path,'offsets.npy'))
+
+    #datasets of format version 1 stored the calendar as it was
+    date_description = metadata.get('dates',{'kind':'array'})
+    return {'date_index':_decode_dates(np.load(os.path.join(path,'dates.npy')),date_description),
+            'sym_list':metadata['symbols'],
+            'fields':metadata['fields'],
+            'prices':prices,
+            'symbol_positions':_unpack_positions(positions,offsets),
+            'beginning_update_list':metadata['beginning update list']}
@@ -0,0 +1,45 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+
+class Feature:
+
+    '''Derived series of every symbol computed once for the whole calendar and stored aligned to the price cube, one row per
+    symbol and one column per bar. The beginning/end of bar rules are built in: a feature computed from data types that are
+    not all in the beginning update list lags one bar at the beginning of a bar, so it can only be read up to the previous
+    bar. The values are kept behind a column of NaN, so reading before the first bar returns NaN without a check'''
+
+    def __init__(self,name,values,fields,beginning_update_list):
+
+        '''inputs:
+        name (string): name of the feature
+        values (numpy array): values of shape (symbol, bar)
+        fields (tuple): data types the feature is computed from, including the data types of features it is computed from
+        beginning_update_list (list): data types updated at the beginning of the bar'''
+
+        self.name = name
+        self.fields = tuple(fields)
+        self._values = np.full((values.shape[0],values.shape[1]+1),np.nan)
+        self._values[:,1:] = values
+        self._values.flags.writeable = False
+        #number of bars the feature lags the current bar at each time of bar
+        self._lag = {'begin':0 if all(field in beginning_update_list for field in self.fields) else 1,'end':0}
+
+    @property
+    def values(self):
+
+        '''Read only values of shape (symbol, bar) of every bar, without the look-ahead shift'''
+
+        return self._values[:,1:]
+
+    def current(self,bar,tob):
+
+        '''Returns a read only view of the value of every symbol that can be seen at a bar and time of bar'''
+
+        return self._values[:,bar+1-self._lag[tob]]
+
+    def window(self,bar,tob,number_of_bars):
+
+        '''Returns a read only view of the last number_of_bars values of every symbol that can be seen at a bar and time of bar'''
+
+        stop = bar+2-self._lag[tob]
+        return self._values[:,max(stop-number_of_bars,1):stop]
@@ -0,0 +1,122 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+import pandas as pd
+
+class AccountHistory:
+
+    '''Stores the account history of a backtest in preallocated numpy arrays indexed by bar position. Positions are stored
+    sparsely as one (bar, symbol row, quantity) entry per held symbol per bar, so recording a bar costs the number of held
+    symbols, not the number of symbols. The account history and account results dataframes are only built when they are
+    requested'''
+
+    def __init__(self,date_index,sym_list,cash,record_positions = True):
+
+        '''inputs:
+        date_index (pandas index): dates of every bar in the backtest
+        sym_list (list): symbols in the backtest, the position of a symbol in this list is its row
+        cash (float): amount of cash the backtest starts with
+        record_positions (bool): records the quantity of every held symbol each bar. Default is True. When False only the
+            cash, borrowed funds and account value are recorded'''
+
+        self.date_index = date_index
+        self.sym_list = list(sym_list)
+        self.record_positions = record_positions
+
+        no_of_bars = len(date_index)
+        self.cash = np.full(no_of_bars,np.nan)
+        self.borrowed_funds = np.full(no_of_bars,np.nan)
+        self.value = np.full(no_of_bars,np.nan)
+
+        #held positions at the end of each bar, the first size entries are used and the arrays double when they are full
+        self._position_bars = np.empty(64,dtype = np.int64)
+        self._position_rows = np.empty(64,dtype = np.int64)
+        self._position_quantities = np.empty(64)
+        self._size = 0
+
+        #the first bar starts with the initial cash in case the backtest is read before it is run
+        self.cash[0] = cash
+        self.borrowed_funds[0] = 0
+        self.value[0] = cash
+
+        self._account_history = None
+        self._account_results = None
+
+    def _add_positions(self,bars,rows,quantities):
+        #appends position entries, doubling the arrays when they are full
+        size = self._size+len(rows)
+        if size > len(self._position_rows):
+            capacity = max(size,2*len(self._position_rows))
+            for name in ('_position_bars','_position_rows','_position_quantities'):
+                old = getattr(self,name)
+                new = np.empty(capacity,dtype = old.dtype)
+                new[:self._size] = old[:self._size]
+                setattr(self,name,new)
+        self._position_bars[self._size:size] = bars
+        self._position_rows[self._size:size] = rows
+        self._position_quantities[self._size:size] = quantities
+        self._size = size
+
+    def record(self,bar,cash,borrowed_funds,value,rows,quantities):
+
+        '''Records the state of the account at the end of a bar
+
+        inputs:
+        bar (int): position of the bar in the date index
+        cash (float): cash in the account
+        borrowed_funds (float): borrowed funds in the account
+        value (float): account value
+        rows (numpy array): rows of the held symbols
+        quantities (numpy array): signed quantity held of each of those symbols, negative values are short positions'''
+
+        self.cash[bar] = cash
+        self.borrowed_funds[bar] = borrowed_funds
+        self.value[bar] = value
+        if self.record_positions and len(rows) > 0:
+            self._add_positions(bar,rows,quantities)
+        self._account_history = None
+        self._account_results = None
+
+    def set_positions(self,quantity):
+
+        '''Replaces the recorded positions with a dense array of the quantity of every symbol on every bar
+
+        inputs:
+        quantity (numpy array): signed quantities of shape (bar, symbol row)'''
+
+        bars,rows = np.nonzero(quantity)
+        self._size = 0
+        self._add_positions(bars,rows,quantity[bars,rows])
+        self._account_history = None
+
+    def account_history(self,close_prices):
+
+        '''Returns a dataframe with the cash, borrowed funds and account value of the account along with the quantity and
+        value of every symbol held during the backtest for each bar. Columns are grouped under 'account', 'quantity' and
+        'value'. When positions are not recorded only the 'account' columns are included
+
+        inputs:
+        close_prices (numpy array): close price of every symbol on every bar, of shape (symbol row, bar). Only used when
+            positions are recorded'''
+
+        if self._account_history is None:
+            frames = {'account':pd.DataFrame({'cash':self.cash,'borrowed funds':self.borrowed_funds,'account value':self.value},index = self.date_index)}
+            if self.record_positions:
+                bars = self._position_bars[:self._size]
+                held_rows,columns = np.unique(self._position_rows[:self._size],return_inverse = True)
+                quantity = np.zeros((len(self.date_index),len(held_rows)))
+                quantity[bars,columns] = self._position_quantities[:self._size]
+                symbols = [self.sym_list[row] for row in held_rows.tolist()]
+                #positions are marked at the close of the bar, bars without a position are worth 0
+                value = np.where(quantity != 0,quantity*np.asarray(close_prices)[held_rows].T,0.0)
+                frames['quantity'] = pd.DataFrame(quantity,index = self.date_index,columns = symbols)
+                frames['value'] = pd.DataFrame(value,index = self.date_index,columns = symbols)
+            self._account_history = pd.concat(frames,axis = 1)
+        return self._account_history
+
+    def account_results(self):
+
+        '''Returns a dataframe with the cash and account value for each bar'''
+
+        if self._account_results is None:
+            self._account_results = pd.DataFrame({'cash':self.cash,'value':self.value},index = self.date_index)
+        return self._account_results
@@ -0,0 +1,256 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+import pandas as pd
+
+#Technical indicators used by DataHandler.indicator. Every indicator can be computed two ways that give the same values:
+#   compute   the whole history of one symbol at once with vectorized operations, used by DataHandler, which holds every bar
+#   update    one bar at a time for many symbols at once in O(1) per symbol, used by StreamingDataHandler, which only
+#             sees each bar once
+#Indicators are computed over the bars a symbol has data for, so bars where the symbol has no data are skipped. The first
+#period-1 values (period for RSI) are NaN. Add indicators to INDICATORS to make them available by name
+
+class Indicator:
+
+    '''Base class of the indicators. Subclasses implement compute, start and update'''
+
+    #data types the indicator is computed from. None for indicators of one data type that is chosen when they are requested
+    fields = None
+
+    def __init__(self,period):
+
+        '''inputs:
+        period (int): number of bars of the indicator'''
+
+        if period < 1:
+            raise ValueError('period must be at least 1')
+        self.period = int(period)
+
+    def compute(self,*series):
+
+        '''Returns the indicator over the whole history of one symbol as a numpy array
+
+        inputs:
+        series (arrays): values of each data type of the indicator on every bar of the symbol'''
+
+        raise NotImplementedError
+
+    def start(self,no_of_syms):
+
+        '''Creates the state of update for no_of_syms symbol rows'''
+
+        raise NotImplementedError
+
+    def update(self,rows,*values):
+
+        '''Adds one bar to symbol rows and returns the new values of the indicator for those rows
+
+        inputs:
+        rows (array): rows of the symbols with a new bar, each row at most once
+        values (arrays): values of each data type of the indicator on the new bar, one per row'''
+
+        raise NotImplementedError
+
+class _Window:
+    #ring buffer of the last period values of every symbol row
+    def __init__(self,no_of_syms,period,fill = 0.0):
+        self.values = np.full((no_of_syms,period),fill)
+        self.count = np.zeros(no_of_syms,dtype = np.int64)
+        self.period = period
+
+    def push(self,rows,x):
+        #adds x to rows and returns the slots written, the values they held and the new counts
+        slots = self.count[rows] % self.period
+        old = self.values[rows,slots]
+        self.values[rows,slots] = x
+        self.count[rows] += 1
+        return slots,old,self.count[rows]
+
+def _ewm(x,alpha,period):
+    #exponentially weighted mean started at the first value, NaN before period values
+    return pd.Series(x).ewm(alpha = alpha,adjust = False,min_periods = period).mean().to_numpy()
+
+class SMA(Indicator):
+
+    '''Simple moving average'''
+
+    def compute(self,x):
+        return pd.Series(x).rolling(self.period).mean().to_numpy()
+
+    def start(self,no_of_syms):
+        self._window = _Window(no_of_syms,self.period)
+        self._sum = np.zeros(no_of_syms)
+
+    def update(self,rows,x):
+        slots,old,count = self._window.push(rows,x)
+        self._sum[rows] += x-old
+        return np.where(count >= self.period,self._sum[rows]/self.period,np.nan)
+
+class EMA(Indicator):
+
+    '''Exponential moving average with a smoothing factor of 2/(period+1), started at the first value'''
+
+    def compute(self,x):
+        return _ewm(x,2/(self.period+1),self.period)
+
+    def start(self,no_of_syms):
+        self._ema = np.zeros(no_of_syms)
+        self._count = np.zeros(no_of_syms,dtype = np.int64)
+
+    def update(self,rows,x):
+        alpha = 2/(self.period+1)
+        ema = np.where(self._count[rows] == 0,x,(1-alpha)*self._ema[rows]+alpha*x)
+        self._ema[rows] = ema
+        self._count[rows] += 1
+        return np.where(self._count[rows] >= self.period,ema,np.nan)
+
+class RollingStd(Indicator):
+
+    '''Rolling sample standard deviation. The rolling mean and sum of squared deviations are updated as values enter and
+    leave the window, and are recomputed from the window once every period bars so rounding errors do not build up'''
+
+    def __init__(self,period):
+        if period < 2:
+            raise ValueError('period must be at least 2')
+        Indicator.__init__(self,period)
+
+    def compute(self,x):
+        return pd.Series(x).rolling(self.period).std().to_numpy()
+
+    def start(self,no_of_syms):
+        self._window = _Window(no_of_syms,self.period)
+        self._mean = np.zeros(no_of_syms)
+        self._m2 = np.zeros(no_of_syms)
+
+    def update(self,rows,x):
+        slots,old,count = self._window.push(rows,x)
+        mean = self._mean[rows]
+        full = count > self.period
+        #a value replaces the oldest one once the window is full, otherwise it is added to the window
+        new_mean = np.where(full,mean+(x-old)/self.period,mean+(x-mean)/np.minimum(count,self.period))
+        m2 = self._m2[rows]+np.where(full,(x-old)*(x-new_mean+old-mean),(x-mean)*(x-new_mean))
+        #recomputes the rows whose window has just been refilled
+        refilled = (count % self.period == 0)
+        if refilled.any():
+            window = self._window.values[rows[refilled]]
+            new_mean[refilled] = window.mean(axis = 1)
+            m2[refilled] = ((window-new_mean[refilled,None])**2).sum(axis = 1)
+        self._mean[rows] = new_mean
+        self._m2[rows] = m2
+        return np.where(count >= self.period,np.sqrt(np.maximum(m2,0)/(self.period-1)),np.nan)
+
+class RSI(Indicator):
+
+    '''Relative strength index with Wilder's smoothing (a smoothing factor of 1/period) of the gains and losses between bars'''
+
+    def compute(self,x):
+        change = np.diff(x)
+        gain = _ewm(np.maximum(change,0),1/self.period,self.period)
+        loss = _ewm(np.maximum(-change,0),1/self.period,self.period)
+        with np.errstate(invalid = 'ignore',divide = 'ignore'):
+            return np.concatenate(([np.nan],100*gain/(gain+loss)))[:len(x)]
+
+    def start(self,no_of_syms):
+        self._previous = np.zeros(no_of_syms)
+        self._gain = np.zeros(no_of_syms)
+        self._loss = np.zeros(no_of_syms)
+        self._count = np.zeros(no_of_syms,dtype = np.int64)
+
+    def update(self,rows,x):
+        alpha = 1/self.period
+        count = self._count[rows]
+        change = x-self._previous[rows]
+        first = count == 1
+        gain = np.where(first,np.maximum(change,0),(1-alpha)*self._gain[rows]+alpha*np.maximum(change,0))
+        loss = np.where(first,np.maximum(-change,0),(1-alpha)*self._loss[rows]+alpha*np.maximum(-change,0))
+        #the first bar of a symbol only sets the previous value
+        started = count > 0
+        self._gain[rows] = np.where(started,gain,0)
+        self._loss[rows] = np.where(started,loss,0)
+        self._previous[rows] = x
+        self._count[rows] = count+1
+        with np.errstate(invalid = 'ignore',divide = 'ignore'):
+            return np.where(count >= self.period,100*gain/(gain+loss),np.nan)
+
+class ATR(Indicator):
+
+    '''Average true range with Wilder's smoothing (a smoothing factor of 1/period). The true range of a symbol's first bar
+    is its high minus its low'''
+
+    fields = ('high','low','close')
+
+    def compute(self,high,low,close):
+        previous = np.concatenate(([np.nan],close[:-1]))
+        true_range = np.fmax(high-low,np.fmax(np.abs(high-previous),np.abs(low-previous)))
+        return _ewm(true_range,1/self.period,self.period)
+
+    def start(self,no_of_syms):
+        self._previous = np.full(no_of_syms,np.nan)
+        self._atr = np.zeros(no_of_syms)
+        self._count = np.zeros(no_of_syms,dtype = np.int64)
+
+    def update(self,rows,high,low,close):
+        alpha = 1/self.period
+        previous = self._previous[rows]
+        true_range = np.fmax(high-low,np.fmax(np.abs(high-previous),np.abs(low-previous)))
+        count = self._count[rows]
+        atr = np.where(count == 0,true_range,(1-alpha)*self._atr[rows]+alpha*true_range)
+        self._atr[rows] = atr
+        self._previous[rows] = close
+        self._count[rows] = count+1
+        return np.where(count+1 >= self.period,atr,np.nan)
+
+class RollingMax(Indicator):
+
+    '''Rolling maximum. Updates split each symbol's bars into blocks of period bars: the window maximum is the larger of the
+    maximum of the current block so far and the maximum of the rest of the window in the previous block, which is computed
+    once per block, so updates are O(1) per bar on average'''
+
+    #1 for the maximum, -1 for the minimum
+    _sign = 1
+
+    def compute(self,x):
+        rolling = pd.Series(self._sign*x).rolling(self.period).max().to_numpy()
+        return self._sign*rolling
+
+    def start(self,no_of_syms):
+        self._window = _Window(no_of_syms,self.period,-np.inf)
+        #maximum of the current block so far, and of every slot to the end of the previous block with -inf after the last slot
+        self._prefix = np.full(no_of_syms,-np.inf)
+        self._suffix = np.full((no_of_syms,self.period+1),-np.inf)
+
+    def update(self,rows,x):
+        x = self._sign*np.asarray(x,dtype = np.float64)
+        slots = self._window.count[rows] % self.period
+        new_block = rows[slots == 0]
+        if len(new_block) > 0:
+            #the window holds the whole previous block when a new block starts
+            self._suffix[new_block,:self.period] = np.maximum.accumulate(self._window.values[new_block,::-1],axis = 1)[:,::-1]
+        slots,old,count = self._window.push(rows,x)
+        prefix = np.where(slots == 0,x,np.maximum(self._prefix[rows],x))
+        self._prefix[rows] = prefix
+        maximum = np.maximum(self._suffix[rows,slots+1],prefix)
+        return np.where(count >= self.period,self._sign*maximum,np.nan)
+
+class RollingMin(RollingMax):
+
+    '''Rolling minimum, computed like RollingMax'''
+
+    _sign = -1
+
+#indicators by name
+INDICATORS = {'SMA':SMA,
+              'EMA':EMA,
+              'STD':RollingStd,
+              'RSI':RSI,
+              'ATR':ATR,
+              'MAX':RollingMax,
+              'MIN':RollingMin}
+
+def indicator_key(name,period,data_type):
+
+    '''Returns the key an indicator is cached under: (name, data types, period)'''
+
+    if name not in INDICATORS:
+        raise KeyError('unknown indicator '+repr(name)+', the indicators are '+str(list(INDICATORS)))
+    fields = INDICATORS[name].fields
+    return (name,fields if fields is not None else (data_type,),int(period))
@@ -0,0 +1,120 @@
+'''Author: Jacob Atnip'''
+from collections import OrderedDict
+import numpy as np
+from backtest import dataset
+
+#Finer grained bars (for example 1 minute bars within daily bars) used to find where in a bar resting orders fill. The
+#sub-bars are read from a dataset written by write_dataset (DataHandler.save_dataset of the finer data). A sub-bar belongs
+#to the bar of the backtest whose date is the latest date at or before the sub-bar's date
+
+def _nanoseconds(dates):
+    #returns dates as int64 nanoseconds, timezone aware dates are taken in UTC
+    return np.asarray(dates.values,dtype = 'datetime64[ns]').view(np.int64)
+
+class IntrabarData:
+
+    '''Sub-bars of a dataset on disk. The dataset is memory mapped the first time sub-bars are requested, and the sub-bars of
+    a symbol within a bar are read from disk the first time they are requested and kept in a cache of the most recently used
+    (symbol, bar) pairs, so only the bars that orders are due on are ever read'''
+
+    def __init__(self,path,cache_size = 4096):
+
+        '''inputs:
+        path (file path): directory of a dataset with 'open', 'high' and 'low' data of the sub-bars
+        cache_size (int): number of (symbol, bar) pairs kept in the cache. Default is 4096'''
+
+        self.path = path
+        self.cache_size = cache_size
+        self._arrays = None
+        self._calendar = None
+        self._cache = OrderedDict()
+        #number of (symbol, bar) pairs read from disk
+        self.reads = 0
+
+    def _open(self):
+        #memory maps the dataset
+        arrays = dataset.read_dataset(self.path,mmap = True)
+        missing = [field for field in ('open','high','low') if field not in arrays['fields']]
+        if missing:
+            raise KeyError('intrabar dataset has no '+str(missing)+' data')
+        self._arrays = arrays
+        self._sym_to_row = {sym:i for i,sym in enumerate(arrays['sym_list'])}
+        self._field_rows = [arrays['fields'].index(field) for field in ('open','high','low')]
+        self._dates = _nanoseconds(arrays['date_index'])
+
+    def _bar_bounds(self,date_index):
+        #returns the first sub-bar of every bar of date_index, with the number of sub-bars at the end
+        if self._arrays is None:
+            self._open()
+        if self._calendar is not date_index:
+            #sub-bars before the first bar do not belong to any bar
+            self._bounds = np.append(np.searchsorted(self._dates,_nanoseconds(date_index)),len(self._dates))
+            self._calendar = date_index
+            self._cache.clear()
+        return self._bounds
+
+    def sub_bars(self,symbol,bar,date_index):
+
+        '''Returns the dates (as int64 nanoseconds), opens, highs and lows of the sub-bars of a symbol within a bar, or None
+        when the dataset has no sub-bars for it
+
+        inputs:
+        symbol (string): symbol
+        bar (int): bar of date_index
+        date_index (pandas index): calendar of the backtest'''
+
+        bounds = self._bar_bounds(date_index)
+        key = (symbol,bar)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        row = self._sym_to_row.get(symbol)
+        sub_bars = None
+        if row is not None and bounds[bar+1] > bounds[bar]:
+            first,last = bounds[bar],bounds[bar+1]
+            block = np.asarray(self._arrays['prices'][row,self._field_rows,first:last])
+            kept = ~np.isnan(block).any(axis = 0)
+            if kept.any():
+                sub_bars = (self._dates[first:last][kept],block[0,kept],block[1,kept],block[2,kept])
+            self.reads += 1
+
+        self._cache[key] = sub_bars
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last = False)
+        return sub_bars
+
+def first_touch(sign,level,opens,extremes):
+
+    '''Returns the position of the first sub-bar whose extreme reaches level and the fill price there (the level, or the open
+    when the sub-bar opens through it), or (None, NaN) when no sub-bar reaches it
+
+    inputs:
+    sign (float): 1 for levels reached by rising prices, -1 for levels reached by falling prices
+    level (float or array): level, or one level per sub-bar
+    opens (array): opens of the sub-bars
+    extremes (array): highs of the sub-bars when sign is 1, lows when sign is -1'''
+
+    touched = np.flatnonzero(sign*extremes >= sign*level)
+    if len(touched) == 0:
+        return None,np.nan
+    k = touched[0]
+    return k,sign*max(sign*opens[k],sign*(level[k] if np.ndim(level) else level))
+
+def trailing_levels(sign,reference,trail_amount,trail_percent,bests):
+
+    '''Returns the level of a trailing stop at every sub-bar, moved after each sub-bar by its best price, and the best price
+    after the last sub-bar
+
+    inputs:
+    sign (float): 1 for buy stops, -1 for sell stops
+    reference (float): best price before the first sub-bar
+    trail_amount (float): distance of the stop from the best price, NaN when trail_percent is used
+    trail_percent (float): distance of the stop as a fraction of the best price
+    bests (array): lows of the sub-bars for buy stops, highs for sell stops'''
+
+    direction = -sign
+    best = direction*np.maximum.accumulate(direction*np.concatenate(([reference],bests)))
+    before = best[:-1]
+    offset = before*trail_percent if np.isnan(trail_amount) else trail_amount
+    return before+sign*offset,best[-1]
@@ -0,0 +1,123 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+from backtest.lots import LotBook
+
+class PositionLedger:
+
+    '''Positions of an account held in parallel numpy arrays indexed by symbol row (the position of the symbol in sym_list).
+    Quantities are signed, short positions are negative. The cost basis is the cost of the open units of a position and is
+    positive for long and short positions. Rows of symbols that are not held have a quantity of 0. The lots of every
+    position are kept in a LotBook, which also records the realized profit and loss of every closed lot'''
+
+    def __init__(self,sym_list,lot_method = 'FIFO'):
+
+        '''inputs:
+        sym_list (list): symbols that can be held, the position of a symbol in this list is its row
+        lot_method (string): 'FIFO', 'LIFO' or 'average', how the cost of closed units is taken from the lots. Default is 'FIFO' '''
+
+        no_of_syms = len(sym_list)
+        self.sym_array = np.array(list(sym_list),dtype = object)
+        self.quantity = np.zeros(no_of_syms)
+        self.cost_basis = np.zeros(no_of_syms)
+        #bar the position was opened on, -1 when the symbol is not held
+        self.open_bar = np.full(no_of_syms,-1,dtype = np.int64)
+        #signed value of the position at the last price it was marked or filled at
+        self.value = np.zeros(no_of_syms)
+        #ID of the most recent order of the position, -1 when the symbol is not held
+        self.last_order = np.full(no_of_syms,-1,dtype = np.int64)
+        self.lots = LotBook(lot_method)
+
+        self._held_rows = np.array([],dtype = np.int64)
+        self._positions = ()
+        self._held_changed = False
+
+    @property
+    def held_rows(self):
+
+        '''Sorted rows of the symbols with an open position'''
+
+        if self._held_changed:
+            self._held_rows = np.flatnonzero(self.quantity)
+            self._positions = tuple(self.sym_array[self._held_rows].tolist())
+            self._held_changed = False
+        return self._held_rows
+
+    @property
+    def positions(self):
+
+        '''Tuple of the symbols with an open position, in sym_list order'''
+
+        self.held_rows
+        return self._positions
+
+    def fill(self,row,quantity,price,bar,order_ID):
+
+        '''Applies a fill of quantity units (negative to sell or short) at price to the position of a symbol row
+
+        inputs:
+        row (int): row of the symbol
+        quantity (float): units filled
+        price (float): fill price
+        bar (int): bar of the fill
+        order_ID (int): ID of the filled order'''
+
+        old = self.quantity[row]
+        new = old+quantity
+        side = 'long' if old > 0 else 'short'
+        if new == 0:
+            #closes the position
+            self.lots.clear(row,price,bar,side)
+            self.cost_basis[row] = 0
+            self.open_bar[row] = -1
+            self.last_order[row] = -1
+        elif old == 0 or (old > 0) != (new > 0):
+            #opens a position, or closes the position and opens one on the other side with the rest of the fill
+            if old != 0:
+                self.lots.clear(row,price,bar,side)
+            self.lots.add(row,abs(new),price,bar)
+            self.cost_basis[row] = abs(new)*price
+            self.open_bar[row] = bar
+            self.last_order[row] = order_ID
+        elif (quantity > 0) == (old > 0):
+            #adds to the position
+            self.lots.add(row,abs(quantity),price,bar)
+            self.cost_basis[row] = abs(quantity)*price+self.cost_basis[row]
+            self.last_order[row] = order_ID
+        else:
+            #reduces the position
+            self.cost_basis[row] = self.cost_basis[row]-self.lots.consume(row,abs(quantity),price,bar,side)
+            self.last_order[row] = order_ID
+
+        self.quantity[row] = new
+        self.value[row] = new*price
+        if old == 0 or new == 0:
+            self._held_changed = True
+
+    def close(self,rows,bar):
+
+        '''Closes the positions of symbol rows at the price they were last marked at without a fill
+
+        inputs:
+        rows (array): rows of the symbols
+        bar (int): bar the positions are closed on'''
+
+        for row in np.atleast_1d(rows).tolist():
+            quantity = self.quantity[row]
+            self.lots.clear(row,self.value[row]/quantity,bar,'long' if quantity > 0 else 'short')
+        self.quantity[rows] = 0
+        self.cost_basis[rows] = 0
+        self.value[rows] = 0
+        self.open_bar[rows] = -1
+        self.last_order[rows] = -1
+        self._held_changed = True
+
+    def mark(self,prices):
+
+        '''Values every position at prices (one price per symbol row) and returns the net value and the gross value of
+        the positions'''
+
+        held_rows = self.held_rows
+        held_prices = prices[held_rows]
+        held_quantity = self.quantity[held_rows]
+        self.value[held_rows] = held_quantity*held_prices
+        return np.dot(held_quantity,held_prices),np.dot(np.abs(held_quantity),held_prices)
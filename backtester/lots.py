@@ -0,0 +1,101 @@
+'''Author: Jacob Atnip'''
+from collections import deque
+import numpy as np
+import pandas as pd
+
+#lot accounting methods. FIFO closes the oldest lot first, LIFO the newest and average pools every lot of a position
+#into one lot at the average price
+LOT_METHODS = ('FIFO','LIFO','average')
+
+class LotBook:
+
+    '''Tax lots of every position, kept in a deque per symbol row so opening and closing a lot are O(1). Every lot that is
+    closed (fully or partly) adds a realized profit and loss record. Lots hold positive units for long and short positions'''
+
+    def __init__(self,method = 'FIFO'):
+
+        '''inputs:
+        method (string): 'FIFO', 'LIFO' or 'average'. Default is 'FIFO' '''
+
+        if method not in LOT_METHODS:
+            raise ValueError('method must be one of '+str(LOT_METHODS))
+        self.method = method
+        #row -> deque of [units, price, bar] lots, oldest first
+        self._lots = {}
+        #(row, side, units, open bar, close bar, open price, close price, realized profit and loss) for every closed lot
+        self.realized = []
+
+    def add(self,row,units,price,bar):
+
+        '''Adds a lot of units bought (or shorted) at price on bar to a symbol row'''
+
+        lots = self._lots.get(row)
+        if lots is None:
+            lots = self._lots[row] = deque()
+        if self.method == 'average' and lots:
+            lot = lots[0]
+            total = lot[0]+units
+            lot[1] = (lot[0]*lot[1]+units*price)/total
+            lot[0] = total
+        else:
+            lots.append([units,price,bar])
+
+    def consume(self,row,units,price,bar,side):
+
+        '''Closes units of a symbol row's lots at price on bar, records the realized profit and loss of every lot closed
+        and returns the cost of the closed units
+
+        inputs:
+        row (int): row of the symbol
+        units (float): positive number of units to close, every lot is closed when it is more than the lots hold
+        price (float): price the units are closed at
+        bar (int): bar the units are closed on
+        side (string): 'long' or 'short', the side of the position being closed'''
+
+        lots = self._lots.get(row)
+        if lots is None:
+            return 0.0
+        sign = 1 if side == 'long' else -1
+        take = lots.pop if self.method == 'LIFO' else lots.popleft
+        cost = 0.0
+        while units > 0 and lots:
+            lot = lots[-1] if self.method == 'LIFO' else lots[0]
+            used = min(units,lot[0])
+            cost += used*lot[1]
+            self.realized.append((row,side,used,lot[2],bar,lot[1],price,sign*used*(price-lot[1])))
+            if used >= lot[0]:
+                take()
+            else:
+                lot[0] -= used
+            units -= used
+        if not lots:
+            del self._lots[row]
+        return cost
+
+    def clear(self,row,price,bar,side):
+
+        '''Closes every lot of a symbol row at price on bar and returns their cost'''
+
+        return self.consume(row,np.inf,price,bar,side)
+
+    def ladder(self,row):
+
+        '''Returns the open lots of a symbol row as (units, price) pairs, oldest first'''
+
+        return [(lot[0],lot[1]) for lot in self._lots.get(row,())]
+
+    def realized_frame(self,sym_list,date_index):
+
+        '''Returns a dataframe with one row per closed lot: symbol, side, units, open and close dates, open and close prices
+        and realized profit and loss
+
+        inputs:
+        sym_list (list): symbols by row
+        date_index (pandas index): dates by bar'''
+
+        columns = ['row','side','units','open bar','close bar','open price','close price','realized pnl']
+        frame = pd.DataFrame.from_records(self.realized,columns = columns)
+        frame.insert(0,'symbol',np.asarray(sym_list,dtype = object)[frame['row'].to_numpy(dtype = np.int64)])
+        frame.insert(4,'open date',date_index[frame['open bar'].to_numpy(dtype = np.int64)])
+        frame.insert(5,'close date',date_index[frame['close bar'].to_numpy(dtype = np.int64)])
+        return frame.drop(columns = ['row','open bar','close bar'])
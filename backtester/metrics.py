@@ -0,0 +1,208 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+
+#Functions for calculating drawdown metrics from an equity curve. Every function takes a 1-D array like of account values
+#ordered by bar and runs in a single pass over it, so they are fast on long daily or minute equity curves
+
+def running_max(equity):
+
+    '''Returns the highest account value reached up to and including each bar'''
+
+    return np.maximum.accumulate(np.asarray(equity,dtype = np.float64))
+
+def drawdown(equity):
+
+    '''Returns the underwater curve: the drawdown of each bar from the running maximum as a fraction (0 at a new high, negative below it)'''
+
+    equity = np.asarray(equity,dtype = np.float64)
+    return equity/running_max(equity)-1
+
+def max_drawdown(equity):
+
+    '''Returns the largest drawdown of the equity curve as a negative fraction'''
+
+    if len(equity) == 0:
+        return 0.0
+    return float(drawdown(equity).min())
+
+def drawdown_duration(equity):
+
+    '''Returns the number of bars since the last high for each bar (0 at a new high)'''
+
+    equity = np.asarray(equity,dtype = np.float64)
+    bars = np.arange(len(equity))
+    #position of the most recent high carried forward to every bar
+    last_high = np.maximum.accumulate(np.where(equity >= running_max(equity),bars,0))
+    return bars-last_high
+
+def max_drawdown_duration(equity):
+
+    '''Returns the longest number of bars the equity curve spent below a previous high'''
+
+    if len(equity) == 0:
+        return 0
+    return int(drawdown_duration(equity).max())
+
+def recovery_time(equity):
+
+    '''Returns the number of bars from the bottom of the max drawdown until the equity curve gets back to the high before it.
+    Returns None if the curve has not recovered by the last bar'''
+
+    equity = np.asarray(equity,dtype = np.float64)
+    if len(equity) == 0:
+        return 0
+    trough = int(np.argmin(drawdown(equity)))
+    high = equity[:trough+1].max()
+    recovered = np.flatnonzero(equity[trough:] >= high)
+    if len(recovered) == 0:
+        return None
+    return int(recovered[0])
+
+def drawdown_metrics(equity):
+
+    '''Returns a dictionary with the max drawdown, the max drawdown duration in bars and the recovery time in bars of an equity curve'''
+
+    return {'max drawdown':max_drawdown(equity),
+            'max drawdown duration':max_drawdown_duration(equity),
+            'recovery time':recovery_time(equity)}
+
+class RunningMetrics:
+
+    '''Keeps performance metrics up to date one bar at a time with a fixed amount of state, so metrics can be read at any
+    point of a long backtest without storing or rescanning the account history. Volatility uses Welford's online algorithm'''
+
+    def __init__(self,periods_per_year = 252,risk_free_rate = 0.0):
+
+        '''inputs:
+        periods_per_year (int): number of bars in a year, used to annualize volatility, Sharpe and Sortino. Default is 252
+        risk_free_rate (float): annual risk free rate used by Sharpe and Sortino. Default is 0'''
+
+        self.periods_per_year = periods_per_year
+        self.risk_free_rate = risk_free_rate
+
+        self.bars = 0
+        self.start_date = None
+        self.start_value = None
+        self.date = None
+        self.value = None
+        self.high = None
+        self.max_drawdown = 0.0
+        self.exposure = 0.0
+
+        #Welford state of the bar returns and the sum of squared downside returns
+        self._returns = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._downside_squares = 0.0
+        self._exposure_sum = 0.0
+        self._exposure_bars = 0
+
+    def update(self,date,value,exposure = 0.0):
+
+        '''Adds one bar to the metrics
+
+        inputs:
+        date (timestamp): date of the bar
+        value (float): account value at the end of the bar
+        exposure (float): gross value of the positions held divided by the account value. Default is 0'''
+
+        if self.bars == 0:
+            self.start_date = date
+            self.start_value = value
+            self.high = value
+        elif self.value != 0:
+            bar_return = value/self.value-1
+            self._returns += 1
+            delta = bar_return-self._mean
+            self._mean += delta/self._returns
+            self._m2 += delta*(bar_return-self._mean)
+            downside = min(bar_return-self.risk_free_rate/self.periods_per_year,0.0)
+            self._downside_squares += downside*downside
+
+        if value > self.high:
+            self.high = value
+        elif self.high > 0:
+            self.max_drawdown = min(self.max_drawdown,value/self.high-1)
+
+        if exposure == exposure:
+            self.exposure = exposure
+            self._exposure_sum += exposure
+            self._exposure_bars += 1
+
+        self.bars += 1
+        self.date = date
+        self.value = value
+
+    @property
+    def years(self):
+
+        '''Years between the first and the latest bar, from the dates when they are timestamps or from the bar count otherwise'''
+
+        if self.bars == 0:
+            return 0.0
+        try:
+            return (self.date-self.start_date).total_seconds()/(365*24*60*60)
+        except AttributeError:
+            return (self.bars-1)/self.periods_per_year
+
+    @property
+    def CAGR(self):
+
+        '''Compound annual growth rate of the account value so far'''
+
+        years = self.years
+        if years <= 0 or not self.start_value:
+            return np.nan
+        return (self.value/self.start_value)**(1/years)-1
+
+    @property
+    def volatility(self):
+
+        '''Annualized standard deviation of the bar returns so far'''
+
+        if self._returns < 2:
+            return np.nan
+        return np.sqrt(self._m2/(self._returns-1)*self.periods_per_year)
+
+    @property
+    def sharpe(self):
+
+        '''Annualized Sharpe ratio of the bar returns so far'''
+
+        volatility = self.volatility
+        if not volatility:
+            return np.nan
+        excess = self._mean-self.risk_free_rate/self.periods_per_year
+        return excess*self.periods_per_year/volatility
+
+    @property
+    def sortino(self):
+
+        '''Annualized Sortino ratio of the bar returns so far'''
+
+        if self._returns < 2 or self._downside_squares == 0:
+            return np.nan
+        downside_deviation = np.sqrt(self._downside_squares/self._returns)
+        excess = self._mean-self.risk_free_rate/self.periods_per_year
+        return excess/downside_deviation*np.sqrt(self.periods_per_year)
+
+    @property
+    def average_exposure(self):
+
+        '''Average of the exposure passed to update'''
+
+        if self._exposure_bars == 0:
+            return np.nan
+        return self._exposure_sum/self._exposure_bars
+
+    def summary(self):
+
+        '''Returns a dictionary with the current value of every metric'''
+
+        return {'CAGR':self.CAGR,
+                'volatility':self.volatility,
+                'sharpe':self.sharpe,
+                'sortino':self.sortino,
+                'max drawdown':self.max_drawdown,
+                'exposure':self.exposure,
+                'average exposure':self.average_exposure}
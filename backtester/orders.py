@@ -0,0 +1,512 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+import pandas as pd
+from backtest.intrabar import first_touch,trailing_levels
+
+class Order:
+
+    '''Record of one order. Bars are positions in the date index of the backtest. Can be read like the order dictionaries
+    of earlier versions, for example order['symbol'] or order['date of execution']. Fill fields are None until the order
+    is executed'''
+
+    __slots__ = ('ID','symbol','quantity','order_type','execution_time','placement_bar','placement_side','execution_bar',
+                 'execution_price','execution_side','limit_price','stop_price','trail_amount','trail_percent','fill_time',
+                 'slippage','commission','_dates')
+
+    #dictionary keys of earlier versions and the attribute holding each
+    _keys = {'Order ID':'ID',
+             'date of placement':'date_of_placement',
+             'time of placement':'placement_side',
+             'order type':'order_type',
+             'symbol':'symbol',
+             'quantity':'quantity',
+             'desired execution time':'execution_time',
+             'limit price':'limit_price',
+             'stop price':'stop_price',
+             'trail amount':'trail_amount',
+             'trail percent':'trail_percent',
+             'execution price':'execution_price',
+             'date of execution':'date_of_execution',
+             'execution side':'execution_side',
+             'time of fill':'fill_time',
+             'slippage':'slippage',
+             'commission':'commission'}
+
+    def __init__(self,ID,symbol,quantity,order_type,execution_time,placement_bar,placement_side,dates,limit_price = None,
+                 stop_price = None,trail_amount = None,trail_percent = None):
+
+        '''inputs:
+        ID (int): order ID
+        symbol (string): symbol to trade
+        quantity (float): units to trade, negative to sell or short
+        order_type (string): type of order: 'market', 'limit', 'stop', 'stop limit' or 'trailing stop'
+        execution_time (string): 'open' or 'close', the time of bar a market order is executed at. None for resting orders
+        placement_bar (int): bar the order was placed on
+        placement_side (string): 'begin' or 'end', the time of bar the order was placed at
+        dates (pandas index): date index of the backtest, used to turn bars into dates
+        limit_price (float): limit price of limit and stop limit orders. Default is None
+        stop_price (float): stop price of stop and stop limit orders. Default is None
+        trail_amount (float): distance of a trailing stop from the best price since placement. Default is None
+        trail_percent (float): distance of a trailing stop as a fraction of the best price since placement. Default is None'''
+
+        self.ID = ID
+        self.symbol = symbol
+        self.quantity = quantity
+        self.order_type = order_type
+        self.execution_time = execution_time
+        self.placement_bar = placement_bar
+        self.placement_side = placement_side
+        self.execution_bar = None
+        self.execution_price = None
+        self.execution_side = None
+        self.limit_price = limit_price
+        self.stop_price = stop_price
+        self.trail_amount = trail_amount
+        self.trail_percent = trail_percent
+        #date of the sub-bar the order filled in, only set for resting orders filled with intrabar data
+        self.fill_time = None
+        #costs of the fill from the cost models of the execution, in currency. Slippage is included in the execution price
+        self.slippage = None
+        self.commission = None
+        self._dates = dates
+
+    @property
+    def date_of_placement(self):
+        return self._dates[self.placement_bar]
+
+    @property
+    def date_of_execution(self):
+        if self.execution_bar is None:
+            return None
+        return self._dates[self.execution_bar]
+
+    def __getitem__(self,key):
+        value = getattr(self,self._keys[key])
+        if value is None:
+            #fill fields of an order that has not been executed did not exist in the order dictionaries
+            raise KeyError(key)
+        return value
+
+    def to_dict(self):
+
+        '''Returns the order as a dictionary with the keys of earlier versions'''
+
+        return {key:getattr(self,self._keys[key]) for key in self._keys if getattr(self,self._keys[key]) is not None}
+
+    def __repr__(self):
+        return 'Order('+repr(self.to_dict())+')'
+
+class OrderLog:
+
+    '''Append only log of the orders of a backtest. Every order is added once when it is placed and once more when it is
+    executed, and the order series are built from the log when they are requested'''
+
+    def __init__(self,date_index):
+
+        '''inputs:
+        date_index (pandas index): dates of every bar in the backtest'''
+
+        self.date_index = date_index
+        #every order in the order it was placed
+        self.orders = []
+        #executed orders in the order they were executed
+        self.fills = []
+
+    def place(self,order):
+
+        '''Adds a newly placed order to the log'''
+
+        self.orders.append(order)
+
+    def fill(self,order):
+
+        '''Adds an executed order to the log'''
+
+        self.fills.append(order)
+
+    def order_series(self):
+
+        '''Returns a series with a tuple of the orders executed on each bar, or ('No orders',) for bars without any'''
+
+        return self._series(self.fills,[order.execution_bar for order in self.fills],('No orders',))
+
+    def pending_order_series(self):
+
+        '''Returns a series with a tuple of the orders placed on each bar, or ('No pending orders',) for bars without any'''
+
+        return self._series(self.orders,[order.placement_bar for order in self.orders],('No pending orders',))
+
+    def _series(self,orders,bars,empty):
+        #groups orders by bar into a series of tuples over the date index
+        grouped = {}
+        for order,bar in zip(orders,bars):
+            grouped.setdefault(bar,[]).append(order)
+        values = [empty]*len(self.date_index)
+        for bar in grouped:
+            values[bar] = tuple(grouped[bar])
+        return pd.Series(values,index = self.date_index,dtype = object)
+
+    def to_frame(self):
+
+        '''Returns a dataframe with one row per order placed, indexed by order ID'''
+
+        columns = ['date of placement','time of placement','order type','symbol','quantity','desired execution time',
+                   'limit price','stop price','trail amount','trail percent','execution price','date of execution',
+                   'execution side','time of fill','slippage','commission']
+        rows = [[getattr(order,Order._keys[column]) for column in columns] for order in self.orders]
+        return pd.DataFrame(rows,index = pd.Index([order.ID for order in self.orders],name = 'Order ID'),columns = columns)
+
+class PendingOrderBook:
+
+    '''Holds the pending orders of a backtest. Orders are kept in a queue for the execution slot they fill at ('open' or
+    'close') and indexed by symbol, so each scan only touches the orders due at the current time of bar and removing a
+    symbol's orders only touches that symbol's orders. Reads like a dictionary of pending orders keyed by order ID'''
+
+    def __init__(self):
+        #order ID -> order for every pending order, in the order they were added
+        self._orders = {}
+        #execution slot -> {order ID: order}
+        self._queues = {}
+        #symbol -> {order ID: order}
+        self._symbols = {}
+
+    def add(self,order,slot):
+
+        '''Adds an order to the book
+
+        inputs:
+        order (Order): pending order
+        slot (string): execution slot the order fills at, for example 'open' or 'close' '''
+
+        ID = order.ID
+        self._orders[ID] = (order,slot)
+        self._queues.setdefault(slot,{})[ID] = order
+        self._symbols.setdefault(order.symbol,{})[ID] = order
+
+    def pop_due(self,slot):
+
+        '''Removes every order of an execution slot from the book and returns them in the order they were added'''
+
+        queue = self._queues.pop(slot,None)
+        if not queue:
+            return []
+        for ID,order in queue.items():
+            del self._orders[ID]
+            symbol_orders = self._symbols[order.symbol]
+            del symbol_orders[ID]
+            if not symbol_orders:
+                del self._symbols[order.symbol]
+        return list(queue.values())
+
+    def remove(self,ID):
+
+        '''Removes one order from the book'''
+
+        order,slot = self._orders.pop(ID)
+        del self._queues[slot][ID]
+        symbol_orders = self._symbols[order.symbol]
+        del symbol_orders[ID]
+        if not symbol_orders:
+            del self._symbols[order.symbol]
+
+    def remove_symbol(self,symbol):
+
+        '''Removes every order for a symbol from the book'''
+
+        for ID,order in self._symbols.pop(symbol,{}).items():
+            slot = self._orders.pop(ID)[1]
+            del self._queues[slot][ID]
+
+    def symbols(self):
+
+        '''Returns the symbols that have pending orders'''
+
+        return list(self._symbols)
+
+    def symbol_orders(self,symbol):
+
+        '''Returns the pending orders for a symbol'''
+
+        return list(self._symbols.get(symbol,{}).values())
+
+    def __getitem__(self,ID):
+        return self._orders[ID][0]
+
+    def __delitem__(self,ID):
+        self.remove(ID)
+
+    def __contains__(self,ID):
+        return ID in self._orders
+
+    def __iter__(self):
+        return iter(list(self._orders))
+
+    def __len__(self):
+        return len(self._orders)
+
+    def keys(self):
+        return list(self._orders)
+
+    def values(self):
+        return [order for order,slot in self._orders.values()]
+
+    def items(self):
+        return [(ID,order) for ID,(order,slot) in self._orders.items()]
+
+#types of resting orders, the position of a type in this tuple is its code in a RestingOrderBook
+RESTING_ORDER_TYPES = ('limit','stop','stop limit','trailing stop')
+_LIMIT,_STOP,_STOP_LIMIT,_TRAILING_STOP = range(len(RESTING_ORDER_TYPES))
+
+class RestingOrderBook:
+
+    '''Holds the limit, stop, stop limit and trailing stop orders of a backtest in parallel numpy arrays, one entry per
+    order in order ID order, so every resting order is checked against a bar's open, high and low with one set of array
+    comparisons. Reads like a dictionary of resting orders keyed by order ID
+
+    Orders fill at their level, or at the open when the bar opens through the level. A stop limit order that is triggered
+    fills on that bar only if the trigger price is within the limit, otherwise it rests as a limit order from the next bar.
+    A trailing stop trails the best price since it was placed (the highest high for sell stops, the lowest low for buy
+    stops) by trail amount or by trail percent of that price, and is moved after the bar is checked'''
+
+    _dtypes = {'ID':np.int64,
+               'row':np.int64,
+               'quantity':np.float64,
+               'kind':np.int8,
+               #price the order is checked against: the limit of limit orders and triggered stop limit orders, otherwise the stop
+               'level':np.float64,
+               #1 when the order is hit by prices rising to the level (buy stops, sell limits), -1 when falling to it
+               'sign':np.float64,
+               #bar price the level is checked against, 1 for the high and 2 for the low
+               'extreme':np.int64,
+               'limit':np.float64,
+               'trail_amount':np.float64,
+               'trail_percent':np.float64,
+               #best price since placement of trailing stops
+               'reference':np.float64,
+               #first bar the order can fill on
+               'start_bar':np.int64,
+               #stop limit orders whose stop has been hit
+               'triggered':np.bool_}
+
+    def __init__(self,capacity = 64):
+        self._arrays = {name:np.empty(capacity,dtype) for name,dtype in self._dtypes.items()}
+        self._n = 0
+        #order ID -> order for every resting order
+        self._orders = {}
+
+    def _columns(self):
+        #returns views of the filled part of every array
+        return {name:array[:self._n] for name,array in self._arrays.items()}
+
+    def add(self,order,row,start_bar,reference = np.nan):
+
+        '''Adds an order to the book
+
+        inputs:
+        order (Order): resting order, its order_type must be in RESTING_ORDER_TYPES
+        row (int): row of the order's symbol
+        start_bar (int): first bar the order can fill on
+        reference (float): starting best price of a trailing stop. Default is NaN'''
+
+        if self._n == len(self._arrays['ID']):
+            for name,array in self._arrays.items():
+                grown = np.empty(2*len(array),array.dtype)
+                grown[:self._n] = array[:self._n]
+                self._arrays[name] = grown
+        kind = RESTING_ORDER_TYPES.index(order.order_type)
+        #buy stops are hit by rising prices and buy limits by falling prices, the other way around for sell orders
+        sign = 1.0 if order.quantity > 0 else -1.0
+        if kind == _LIMIT:
+            sign = -sign
+        values = {'ID':order.ID,
+                  'row':row,
+                  'quantity':order.quantity,
+                  'kind':kind,
+                  'level':order.limit_price if kind == _LIMIT else (np.nan if order.stop_price is None else order.stop_price),
+                  'sign':sign,
+                  'extreme':1 if sign > 0 else 2,
+                  'limit':np.nan if order.limit_price is None else order.limit_price,
+                  'trail_amount':np.nan if order.trail_amount is None else order.trail_amount,
+                  'trail_percent':np.nan if order.trail_percent is None else order.trail_percent,
+                  'reference':reference,
+                  'start_bar':start_bar,
+                  'triggered':False}
+        for name,value in values.items():
+            self._arrays[name][self._n] = value
+        self._n += 1
+        self._orders[order.ID] = order
+
+    def _keep(self,keep):
+        #keeps the orders where keep is True, in the same order
+        for name,array in self._arrays.items():
+            kept = array[:self._n][keep]
+            array[:len(kept)] = kept
+        self._n = int(np.count_nonzero(keep))
+
+    def remove(self,ID):
+
+        '''Removes one order from the book'''
+
+        del self._orders[ID]
+        self._keep(self._arrays['ID'][:self._n] != ID)
+
+    def keep_available(self,available):
+
+        '''Removes every order whose symbol row is not in a mask
+
+        inputs:
+        available (array): boolean mask of the symbol rows whose orders are kept'''
+
+        columns = self._columns()
+        keep = available[columns['row']]
+        if not keep.all():
+            for ID in columns['ID'][~keep].tolist():
+                del self._orders[ID]
+            self._keep(keep)
+
+    def match(self,bar,open_,high,low,sub_bars = None):
+
+        '''Checks every resting order against a bar, removes the orders that fill and returns them with their fill prices
+        as (order, price) pairs. Moves the trailing stops and turns the stop limit orders triggered on the bar into limit
+        orders
+
+        Without sub_bars, orders are checked against the bar's open, high and low and are returned in order ID order. With
+        sub_bars, the orders that may fill on the bar are checked again against the sub-bars of their symbol: each fills at
+        the first sub-bar that reaches its level, stop limit orders can fill at their limit after the sub-bar they are
+        triggered on and trailing stops move after every sub-bar. Orders are then returned in the order they fill and the
+        date of the sub-bar is kept as the order's fill_time
+
+        inputs:
+        bar (int): current bar
+        open_, high, low (arrays): prices of the bar for every symbol row, NaN for symbols without a bar
+        sub_bars (function): takes a symbol row and returns the dates (int64 nanoseconds), opens, highs and lows of its
+        sub-bars within the bar, or None to use the bar. Default is None'''
+
+        if self._n == 0:
+            return []
+        columns = self._columns()
+        rows,kind,level,sign,extreme = columns['row'],columns['kind'],columns['level'],columns['sign'],columns['extreme']
+        no_of_syms = len(open_)
+        prices = np.concatenate((open_,high,low))
+        eligible = columns['start_bar'] <= bar
+
+        #levels of the trailing stops from the best price since placement
+        trailing = np.flatnonzero(kind == _TRAILING_STOP)
+        if len(trailing) > 0:
+            reference = columns['reference'][trailing]
+            percent = columns['trail_percent'][trailing]
+            offset = np.where(np.isnan(percent),columns['trail_amount'][trailing],reference*percent)
+            level[trailing] = reference+sign[trailing]*offset
+
+        #an order is hit when the bar's high (low) reaches its level, and fills at the level or at the open when the bar
+        #opens through it. Flipping the sign of orders hit by falling prices makes both one comparison
+        signed_level = sign*level
+        extremes = sign*prices[rows+no_of_syms*extreme]
+        hit = eligible & (extremes >= signed_level)
+        fill_prices = sign*np.maximum(sign*prices[rows],signed_level)
+
+        #stop limit orders triggered on this bar fill at the trigger price if it is within the limit
+        triggered = hit & (kind == _STOP_LIMIT) & ~columns['triggered']
+        triggered_rows = np.flatnonzero(triggered)
+        if len(triggered_rows) > 0:
+            limit_sign = -sign[triggered_rows]
+            hit[triggered_rows[limit_sign*fill_prices[triggered_rows] < limit_sign*columns['limit'][triggered_rows]]] = False
+
+        #trailing stops follow the bar's best price after the bar is checked
+        if len(trailing) > 0:
+            trailing = trailing[eligible[trailing]]
+            direction = -sign[trailing]
+            best = prices[rows[trailing]+no_of_syms*(3-extreme[trailing])]
+            references = direction*np.fmax(direction*columns['reference'][trailing],direction*best)
+
+        times = None
+        if sub_bars is not None:
+            #orders that may fill on the bar: orders hit by the bar, stop limit orders triggered on it and trailing stops
+            #whose level after following the bar's best price is reached
+            candidates = hit | triggered
+            if len(trailing) > 0:
+                percent = columns['trail_percent'][trailing]
+                furthest = references+sign[trailing]*np.where(np.isnan(percent),columns['trail_amount'][trailing],
+                                                               references*percent)
+                candidates[trailing[extremes[trailing] >= sign[trailing]*furthest]] = True
+            times = np.full(self._n,np.iinfo(np.int64).max)
+            for i in np.flatnonzero(candidates).tolist():
+                path = sub_bars(rows[i])
+                if path is None:
+                    continue
+                dates,opens,highs,lows = path
+                order_sign = sign[i]
+                if kind[i] == _TRAILING_STOP:
+                    levels,best_price = trailing_levels(order_sign,columns['reference'][i],columns['trail_amount'][i],
+                                                        columns['trail_percent'][i],lows if order_sign > 0 else highs)
+                    k,price = first_touch(order_sign,levels,opens,highs if order_sign > 0 else lows)
+                    if k is None:
+                        references[np.searchsorted(trailing,i)] = best_price
+                    else:
+                        level[i] = levels[k]
+                else:
+                    k,price = first_touch(order_sign,level[i],opens,highs if extreme[i] == 1 else lows)
+                    if triggered[i]:
+                        triggered[i] = k is not None
+                        limit_sign = -order_sign
+                        if k is not None and limit_sign*price < limit_sign*columns['limit'][i]:
+                            #the trigger price is outside the limit, the order can fill at the limit on a later sub-bar
+                            j,price = first_touch(limit_sign,columns['limit'][i],opens[k+1:],
+                                                  highs[k+1:] if limit_sign > 0 else lows[k+1:])
+                            k = None if j is None else k+1+j
+                hit[i] = k is not None
+                if k is not None:
+                    fill_prices[i] = price
+                    times[i] = dates[k]
+
+        #stop limit orders triggered on this bar that did not fill become limit orders
+        triggered_rows = np.flatnonzero(triggered & ~hit)
+        if len(triggered_rows) > 0:
+            columns['triggered'][triggered_rows] = True
+            level[triggered_rows] = columns['limit'][triggered_rows]
+            sign[triggered_rows] = -sign[triggered_rows]
+            extreme[triggered_rows] = 3-extreme[triggered_rows]
+        if len(trailing) > 0:
+            columns['reference'][trailing] = references
+
+        fills = np.flatnonzero(hit)
+        if len(fills) == 0:
+            return []
+        if times is not None:
+            #orders are filled in the order they were reached in the bar, orders without sub-bars after them
+            fills = fills[np.argsort(times[fills],kind = 'stable')]
+        result = []
+        for i,ID,price in zip(fills.tolist(),columns['ID'][fills].tolist(),fill_prices[fills].tolist()):
+            order = self._orders.pop(ID)
+            if kind[i] == _TRAILING_STOP:
+                #records the level the trailing stop was at when it was hit
+                order.stop_price = float(level[i])
+            if times is not None and times[i] != np.iinfo(np.int64).max:
+                order.fill_time = pd.Timestamp(int(times[i]))
+            result.append((order,price))
+        self._keep(~hit)
+        return result
+
+    def __getitem__(self,ID):
+        return self._orders[ID]
+
+    def __delitem__(self,ID):
+        self.remove(ID)
+
+    def __contains__(self,ID):
+        return ID in self._orders
+
+    def __iter__(self):
+        return iter(list(self._orders))
+
+    def __len__(self):
+        return self._n
+
+    def keys(self):
+        return list(self._orders)
+
+    def values(self):
+        return list(self._orders.values())
+
+    def items(self):
+        return list(self._orders.items())
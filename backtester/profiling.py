@@ -0,0 +1,125 @@
+'''Author: Jacob Atnip'''
+import time
+import pandas as pd
+
+#phases of a bar that are timed: (name, component of the backtest, method)
+PHASES = (('date and symbol update','datahandler','_update_date_symbols'),
+          ('delisting','account','_remove_delisted_securities'),
+          ('valuation','account','_mark_to_market'),
+          ('order scanning','execution','_scan_and_execute_pending_orders'),
+          ('resting order matching','execution','_match_resting_orders'),
+          ('strategy begin','strategy','strategy_logic_begin'),
+          ('strategy end','strategy','strategy_logic_end'),
+          ('history recording','account','_update_account_history_and_results'),
+          ('running metrics','analysis','_update_running_metrics'),
+          ('analyze','analysis','analyze'))
+
+#data handler methods whose calls are counted
+DATA_METHODS = ('data','data_view','data_views','indicator','indicators','feature','features','feature_view','feature_views')
+
+class ProfileReport:
+
+    '''Timings and counts of one profiled backtest. phases maps each phase name to a (calls, seconds) tuple. Time spent in
+    orders placed by the strategy is part of the strategy phases'''
+
+    def __init__(self,bars,seconds,phases,orders,fills,data_calls):
+        self.bars = bars
+        self.seconds = seconds
+        self.phases = phases
+        self.orders = orders
+        self.fills = fills
+        self.data_calls = data_calls
+
+    @property
+    def bars_per_second(self):
+        return self.bars/self.seconds if self.seconds > 0 else float('nan')
+
+    def to_frame(self):
+
+        '''Returns a dataframe with the calls, total seconds, microseconds per call and share of the backtest time of every phase'''
+
+        frame = pd.DataFrame([self.phases[name] for name in self.phases],index = pd.Index(list(self.phases),name = 'phase'),
+                             columns = ['calls','seconds'])
+        frame['us per call'] = (frame['seconds']/frame['calls'].where(frame['calls'] > 0))*1e6
+        frame['share'] = frame['seconds']/self.seconds if self.seconds > 0 else float('nan')
+        return frame
+
+    def to_dict(self):
+
+        '''Returns the report as a dictionary that can be written to JSON'''
+
+        return {'bars':self.bars,
+                'seconds':self.seconds,
+                'bars per second':self.bars_per_second,
+                'orders':self.orders,
+                'fills':self.fills,
+                'data calls':dict(self.data_calls),
+                'phases':{name:{'calls':calls,'seconds':seconds} for name,(calls,seconds) in self.phases.items()}}
+
+    def __repr__(self):
+        lines = ['ProfileReport: %d bars in %.3fs (%.0f bars/s), %d orders, %d fills, %d data calls'
+                 % (self.bars,self.seconds,self.bars_per_second,self.orders,self.fills,sum(self.data_calls.values()))]
+        for name,(calls,seconds) in self.phases.items():
+            lines.append('    %-24s %10d calls %10.4fs' % (name,calls,seconds))
+        return '\n'.join(lines)
+
+class Profiler:
+
+    '''Times the phases of a backtest by replacing the phase methods of its components with timed versions for the length
+    of the test. Nothing is replaced when a backtest is not profiled, so profiling costs nothing unless it is used'''
+
+    def __init__(self,backtest):
+        self.backtest = backtest
+        self._timings = {name:[0,0.0] for name,component,method in PHASES}
+        self._data_calls = {method:0 for method in DATA_METHODS}
+        self._replaced = []
+
+    def _replace(self,component,method,wrapper):
+        #sets a wrapper of a component's method as an instance attribute, keeping any instance attribute it hides
+        self._replaced.append((component,method,component.__dict__.get(method)))
+        setattr(component,method,wrapper)
+
+    def _timed(self,function,timing):
+        def timed(*args,**kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                timing[0] += 1
+                timing[1] += time.perf_counter()-start
+        return timed
+
+    def _counted(self,function,method):
+        def counted(*args,**kwargs):
+            self._data_calls[method] += 1
+            return function(*args,**kwargs)
+        return counted
+
+    def start(self):
+
+        '''Replaces the phase methods with timed versions and starts the clock'''
+
+        for name,component,method in PHASES:
+            component = getattr(self.backtest,component)
+            self._replace(component,method,self._timed(getattr(component,method),self._timings[name]))
+        datahandler = self.backtest.datahandler
+        for method in DATA_METHODS:
+            self._replace(datahandler,method,self._counted(getattr(datahandler,method),method))
+        self._start = time.perf_counter()
+
+    def stop(self):
+
+        '''Restores the phase methods and returns the ProfileReport of the test'''
+
+        seconds = time.perf_counter()-self._start
+        for component,method,previous in reversed(self._replaced):
+            if previous is None:
+                delattr(component,method)
+            else:
+                setattr(component,method,previous)
+        self._replaced = []
+
+        order_log = self.backtest.execution.order_log
+        return ProfileReport(self.backtest.datahandler._current_bar+1,seconds,
+                             {name:tuple(timing) for name,timing in self._timings.items()},
+                             len(order_log.orders),len(order_log.fills),self._data_calls)
@@ -0,0 +1,132 @@
+'''Author: Jacob Atnip'''
+import json
+import os
+import sys
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from backtest.dataset import _decode_dates,_encode_dates,_encode_symbols,_pack_positions,_unpack_positions
+
+#python versions before 3.13 register every shared memory block opened on posix with the resource tracker
+_REGISTERS_ON_ATTACH = sys.version_info < (3,13) and os.name != 'nt'
+
+def _open_shared_memory(name):
+    #Attaches to an existing shared memory block. The block belongs to the process that created it, so it must not stay
+    #registered with the resource tracker (otherwise the block would be removed when this process exits)
+    if not _REGISTERS_ON_ATTACH:
+        return SharedMemory(name = name,track = False) if sys.version_info >= (3,13) else SharedMemory(name = name)
+    block = SharedMemory(name = name)
+    resource_tracker.unregister(block._name,'shared_memory')
+    return block
+
+class SharedDataset:
+
+    '''Places the data of a DataHandler in shared memory so backtests running in other processes can attach to it by name
+    with DataHandler.attach_shared_data instead of each process holding its own copy.
+
+    Create the dataset in the parent process with SharedDataset.create, pass its name to the workers and call unlink once
+    every worker is finished. Each array lives in its own shared memory block and a small block named after the dataset
+    describes them'''
+
+    def __init__(self,name,blocks,metadata):
+        #use SharedDataset.create or SharedDataset.attach instead of creating the class directly
+        self.name = name
+        self._blocks = blocks
+        self.sym_list = metadata['symbols']
+        self.fields = metadata['fields']
+        self.beginning_update_list = metadata['beginning update list']
+
+        arrays = {}
+        for key in metadata['arrays']:
+            shape,dtype = metadata['arrays'][key]
+            array = np.ndarray(tuple(shape),dtype = np.dtype(dtype),buffer = blocks[key].buf)
+            array.flags.writeable = False
+            arrays[key] = array
+
+        self.prices = arrays['prices']
+        self.date_index = _decode_dates(arrays['dates'],metadata['dates'])
+        #each symbol's positions are a view of the shared positions array
+        self.symbol_positions = _unpack_positions(arrays['positions'],arrays['offsets'])
+
+    @classmethod
+    def create(cls,datahandler,name = None):
+
+        '''Copies the data of a data handler into new shared memory blocks and returns the SharedDataset
+
+        inputs:
+        datahandler (DataHandler): data handler that data series have been added to
+        name (string): name of the dataset. Default is None, which generates a unique name'''
+
+        dates,date_description = _encode_dates(datahandler.date_index)
+        symbols = _encode_symbols(datahandler.sym_list)
+
+        positions,offsets = _pack_positions(datahandler._symbol_positions)
+        arrays = {'prices':datahandler._prices,
+                  'dates':dates,
+                  'positions':positions,
+                  'offsets':offsets}
+
+        metadata = {'symbols':symbols,
+                    'dates':date_description,
+                    'fields':[str(field) for field in datahandler._fields],
+                    'beginning update list':list(datahandler._beginning_update_list),
+                    'arrays':{key:(arrays[key].shape,arrays[key].dtype.str) for key in arrays}}
+        encoded = json.dumps(metadata).encode()
+
+        #the metadata block is created first because its name is the name of the dataset
+        metadata_block = SharedMemory(name = name,create = True,size = len(encoded)+8)
+        metadata_block.buf[:8] = len(encoded).to_bytes(8,'little')
+        metadata_block.buf[8:8+len(encoded)] = encoded
+        name = metadata_block.name
+
+        blocks = {}
+        try:
+            for key in arrays:
+                array = arrays[key]
+                blocks[key] = SharedMemory(name = name+'_'+key,create = True,size = max(array.nbytes,1))
+                np.ndarray(array.shape,dtype = array.dtype,buffer = blocks[key].buf)[...] = array
+        except Exception:
+            for block in list(blocks.values())+[metadata_block]:
+                block.close()
+                block.unlink()
+            raise
+
+        blocks['metadata'] = metadata_block
+        return cls(name,blocks,metadata)
+
+    @classmethod
+    def attach(cls,name):
+
+        '''Attaches to a dataset created by SharedDataset.create in another process without copying it
+
+        inputs:
+        name (string): name of the dataset'''
+
+        metadata_block = _open_shared_memory(name)
+        length = int.from_bytes(bytes(metadata_block.buf[:8]),'little')
+        metadata = json.loads(bytes(metadata_block.buf[8:8+length]).decode())
+        blocks = {key:_open_shared_memory(name+'_'+key) for key in metadata['arrays']}
+        blocks['metadata'] = metadata_block
+        return cls(name,blocks,metadata)
+
+    def close(self):
+
+        '''Closes this process's access to the dataset. Arrays from the dataset must not be used afterwards'''
+
+        self.prices = None
+        self.date_index = None
+        self.symbol_positions = None
+        for block in self._blocks.values():
+            block.close()
+
+    def unlink(self):
+
+        '''Frees the shared memory. Call once from the process that created the dataset after every process has closed it'''
+
+        self.close()
+        for block in self._blocks.values():
+            if _REGISTERS_ON_ATTACH:
+                #processes sharing this process's resource tracker unregister the block when they attach to it, and
+                #unlink unregisters it again
+                resource_tracker.register(block._name,'shared_memory')
+            block.unlink()
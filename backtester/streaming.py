@@ -0,0 +1,189 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+import pandas as pd
+from backtest import dataset
+from backtest.backtest import DataHandler
+from backtest.indicators import INDICATORS,indicator_key
+
+class StreamingDataHandler(DataHandler):
+
+    '''Data handler that reads a dataset saved by DataHandler.save_dataset in time ordered chunks of bars instead of holding
+    every bar. Only the current chunk and a ring buffer of the last bars_to_load+1 bars of each symbol are kept in memory,
+    so memory is bounded by the chunk size and window size times the number of symbols, not by the length of the history.
+
+    Use it by passing datahandler = StreamingDataHandler to Backtest and calling open_dataset instead of add_data_series.
+    data, data_view and data_views work as they do in DataHandler. The account history only records cash, borrowed funds and
+    account value. Indicators are updated one bar at a time as the bars are read, so they must be added with add_indicator
+    before the backtest. Features (add_feature) and VectorizedBacktest need the whole history and are not supported'''
+
+    _keeps_full_history = False
+
+    def open_dataset(self,path,chunk_size = 10000,beginning_update_list = None):
+
+        '''Opens a dataset to stream during the backtest
+
+        inputs:
+        path (file path): directory of a dataset saved by DataHandler.save_dataset
+        chunk_size (int): number of bars read from disk at a time. Default is 10,000
+        beginning_update_list (list): overrides the beginning update list saved with the dataset. Default is None'''
+
+        #the arrays stay memory mapped on disk, only the chunk being tested is read into memory
+        arrays = dataset.read_dataset(path,mmap = True)
+        if beginning_update_list is None:
+            beginning_update_list = arrays['beginning_update_list']
+        self._load_arrays(arrays['date_index'],arrays['sym_list'],arrays['fields'],arrays['prices'],arrays['symbol_positions'],
+                          beginning_update_list)
+        self._data_series = None
+        self._chunk_size = chunk_size
+        #indicators updated as the bars are read, by cache key
+        self._indicators = {}
+
+    def _start_test(self,bars_to_load):
+        #Resets the streaming state at the start of a backtest instead of building DataHandler's availability index. The
+        #ring buffers hold one more bar than bars_to_load because data types not updated at the beginning of the bar read
+        #the bars before the current one
+        depth = bars_to_load+1
+        self._depth = depth
+        self._ring = np.full((len(self.sym_list),len(self._fields),depth),np.nan)
+        self._ring_bars = np.zeros((len(self.sym_list),depth),dtype = np.int64)
+        self._ring_count = np.zeros(len(self.sym_list),dtype = np.int64)
+        self._last_bar = np.full(len(self.sym_list),-1,dtype = np.int64)
+        self._chunk_start = 0
+        self._chunk_stop = 0
+        self._chunk_overlap = 0
+        self._chunk = np.empty((len(self.sym_list),len(self._fields),0))
+
+        #current values of every indicator and their values before the last update
+        self._indicator_state = {}
+        for key,indicator in self._indicators.items():
+            indicator.start(len(self.sym_list))
+            self._indicator_state[key] = (np.full(len(self.sym_list),np.nan),np.full(len(self.sym_list),np.nan))
+
+    def _load_chunk(self,bar):
+        #Reads the next chunk of bars. The last bars of the previous chunk are kept in front of it so windows of the date index
+        #that start before the chunk are still a single slice
+        stop = min(bar+self._chunk_size,len(self.date_index))
+        overlap = min(bar,self._depth)
+        self._chunk = np.array(self._prices[:,:,bar-overlap:stop])
+        self._chunk.flags.writeable = False
+        self._chunk_start = bar
+        self._chunk_stop = stop
+        self._chunk_overlap = overlap
+
+        #finds the symbols with data on each bar of the chunk and sorts them by bar like DataHandler's availability index
+        bars = []
+        rows = []
+        for row,positions in enumerate(self._symbol_positions):
+            first,last = np.searchsorted(positions,[bar,stop])
+            bars.append(np.asarray(positions[first:last])-bar)
+            rows.append(np.full(last-first,row))
+        bars = np.concatenate(bars)
+        order = np.argsort(bars,kind = 'stable')
+        self._chunk_rows = np.concatenate(rows)[order]
+        self._chunk_offsets = np.searchsorted(bars[order],np.arange(stop-bar+1))
+
+    def _update_date_symbols(self):
+        #updates the current date, reads the next chunk when needed, adds the bar to the ring buffers and generates the list
+        #of symbols available for that date
+        self.current_date = next(self._date_iter)
+        self._current_bar += 1
+        bar = self._current_bar
+        if bar >= self._chunk_stop:
+            self._load_chunk(bar)
+
+        local = bar-self._chunk_start
+        rows = self._chunk_rows[self._chunk_offsets[local]:self._chunk_offsets[local+1]]
+        slots = self._ring_count[rows] % self._depth
+        self._ring[rows,:,slots] = self._chunk[rows,:,local+self._chunk_overlap]
+        self._ring_bars[rows,slots] = bar
+        self._ring_count[rows] += 1
+        self._last_bar[rows] = bar
+
+        column = local+self._chunk_overlap
+        for key,indicator in self._indicators.items():
+            current,previous = self._indicator_state[key]
+            previous[:] = current
+            current[rows] = indicator.update(rows,*[self._chunk[rows,self._field_to_row[field],column] for field in key[1]])
+
+        self._available_rows = rows[self._ring_count[rows] >= self._bars_to_load]
+        self.available_symbols = tuple(self._sym_array[self._available_rows])
+
+    def _current_prices(self,data_type):
+        #returns the price of data_type for the current bar of every symbol, ordered by symbol row
+        return self._chunk[:,self._field_to_row[data_type],self._current_bar-self._chunk_start+self._chunk_overlap]
+
+    def _current_price(self,symbol,data_type):
+        #returns the price of data_type for the current bar of a symbol
+        return self._chunk[self._sym_to_row[symbol],self._field_to_row[data_type],self._current_bar-self._chunk_start+self._chunk_overlap]
+
+    def data(self,symbol,data_type,number_of_bars):
+        if number_of_bars > self._bars_to_load:
+            raise ValueError('number_of_bars exceeds the specified bars to load')
+
+        #the symbol's bars are numbered from its first bar, the last depth of them are in the ring buffer
+        row = self._sym_to_row[symbol]
+        if self._last_bar[row] != self._current_bar:
+            raise KeyError(self.current_date)
+        count = int(self._ring_count[row])
+        current_date_location = count-1
+
+        start_location = current_date_location+1-number_of_bars
+        if self._tob == 'begin' and data_type in self._beginning_update_list:
+            locations = range(count)[start_location:current_date_location+1]
+        elif self._tob == 'begin' and data_type not in self._beginning_update_list:
+            locations = range(count)[start_location-1:current_date_location]
+        elif self._tob == 'end':
+            locations = range(count)[start_location:current_date_location+1]
+        slots = np.array(locations,dtype = np.int64) % self._depth
+        return pd.Series(self._ring[row,self._field_to_row[data_type],slots],index = self.date_index[self._ring_bars[row,slots]],name = data_type)
+
+    def data_view(self,symbol,data_type,number_of_bars):
+
+        '''Same as DataHandler.data_view. The view is taken from the current chunk'''
+
+        if number_of_bars > self._bars_to_load:
+            raise ValueError('number_of_bars exceeds the specified bars to load')
+
+        stop = self._window_stop(data_type)-self._chunk_start+self._chunk_overlap
+        return self._chunk[self._sym_to_row[symbol],self._field_to_row[data_type],max(stop-number_of_bars,0):stop]
+
+    def data_views(self,data_type,number_of_bars,symbols = None):
+
+        '''Same as DataHandler.data_views. The view is taken from the current chunk'''
+
+        if number_of_bars > self._bars_to_load:
+            raise ValueError('number_of_bars exceeds the specified bars to load')
+
+        stop = self._window_stop(data_type)-self._chunk_start+self._chunk_overlap
+        window = self._chunk[:,self._field_to_row[data_type],max(stop-number_of_bars,0):stop]
+        if symbols is None:
+            return window
+        return window[[self._sym_to_row[sym] for sym in symbols]]
+
+    def add_indicator(self,name,period,data_type = 'close'):
+
+        '''Same as DataHandler.add_indicator, but the indicator is updated in O(1) per symbol as each bar is read instead of
+        being computed ahead of the backtest. Indicators must be added before the backtest starts'''
+
+        key = indicator_key(name,period,data_type)
+        for field in key[1]:
+            if field not in self._field_to_row:
+                raise KeyError(field)
+        if key not in self._indicators:
+            self._indicators[key] = INDICATORS[name](period)
+
+    def add_feature(self,name,function,inputs):
+
+        '''Not supported: features are computed from the whole history, which the streaming data handler does not hold'''
+
+        raise NotImplementedError('features need the whole history of the data and are not supported by '+
+                                  type(self).__name__+', use DataHandler.load_dataset instead')
+
+    def _indicator_lookup(self,key,rows):
+        #returns the values of an indicator for rows that can be seen at the current time of bar
+        if key not in self._indicators:
+            raise KeyError('indicator '+str(key)+' was not added with add_indicator before the backtest')
+        current,previous = self._indicator_state[key]
+        if self._tob == 'begin' and not all(field in self._beginning_update_list for field in key[1]):
+            return previous[rows]
+        return current[rows]
@@ -0,0 +1,200 @@
+'''Author: Jacob Atnip'''
+import numpy as np
+import pandas as pd
+from backtest.backtest import Strategy
+from backtest.history import AccountHistory
+
+#kinds of cash movements. Follow the rules Account._update_account_with_order uses to move cash and borrowed funds
+_BUY = 0    #paid with cash first, then borrowed funds
+_SELL = 1   #pays back borrowed funds first, then adds to cash
+_SHORT = 2  #added to cash
+
+def _prepare_targets(datahandler,targets):
+    #returns the target quantities as a float array of shape (bar, symbol row). Missing or nan targets keep the previous target
+    if isinstance(targets,pd.DataFrame):
+        targets = targets.reindex(index = datahandler.date_index,columns = datahandler.sym_list).to_numpy(dtype = np.float64)
+    else:
+        targets = np.array(targets,dtype = np.float64)
+        if targets.shape != (len(datahandler.date_index),len(datahandler.sym_list)):
+            raise ValueError('targets must have one row per bar in the date index and one column per symbol')
+    return pd.DataFrame(targets).ffill().fillna(0).to_numpy()
+
+def _available_matrix(datahandler,bars_to_load):
+    #returns a bool array of shape (bar, symbol row) that is True where a symbol is in the available symbols of a bar
+    datahandler._create_availability_index(bars_to_load)
+    offsets = datahandler._availability_offsets
+    available = np.zeros((len(datahandler.date_index),len(datahandler.sym_list)),dtype = bool)
+    available[np.repeat(np.arange(len(offsets)-1),np.diff(offsets)),datahandler._availability_rows] = True
+    return available
+
+class TargetPositionStrategy(Strategy):
+
+    '''Event loop strategy that trades every available symbol to its target quantity with market orders, in symbol order.
+    Gives the same results as VectorizedBacktest.test_targets, so it can be used to check the vectorized engine against
+    the event loop. Set targets (same format as test_targets) and time ('open' or 'close') on the class or the instance'''
+
+    targets = None
+    time = 'close'
+
+    def strategy_logic_begin(self):
+        if self.time == 'open':
+            self._trade_to_targets()
+
+    def strategy_logic_end(self):
+        if self.time == 'close':
+            self._trade_to_targets()
+
+    def _trade_to_targets(self):
+        #places a market order for the difference between the target and the current quantity of each available symbol
+        if getattr(self,'_target_array',None) is None:
+            self._target_array = _prepare_targets(self.datahandler,self.targets)
+        targets = self._target_array[self.datahandler._current_bar]
+        for row in self.datahandler._available_rows:
+            quantity = targets[row]-self.account._quantity[row]
+            if quantity != 0:
+                self.execution.market_order(self.datahandler.sym_list[row],quantity,self.time)
+
+class VectorizedBacktest:
+
+    '''Backtests a strategy given as target quantities for every bar and symbol with array operations instead of the event loop.
+    Orders fill at the open or the close like Execution.market_order, symbols that stop being available are closed out like
+    Account._remove_delisted_securities and cash and borrowed funds follow the same rules as the Account class, so the
+    account results match a Backtest of the same targets'''
+
+    def __init__(self,datahandler):
+
+        '''inputs:
+        datahandler (DataHandler): data handler that data has been added to'''
+
+        if not datahandler._keeps_full_history:
+            raise NotImplementedError('VectorizedBacktest needs the whole history of the data and cannot run on a '+
+                                      type(datahandler).__name__+', use DataHandler.load_dataset instead')
+        self.datahandler = datahandler
+
+    def test_signals(self,signals,quantity,bars_to_load,cash = 100000,time = 'close'):
+
+        '''Tests a signal matrix (for example 1 long, 0 flat, -1 short) by holding signal*quantity units of each symbol. See test_targets
+
+        inputs:
+        signals (pandas dataframe or numpy array): signal for each bar (rows) and symbol (columns)
+        quantity (float or array): units held per unit of signal, either one value or one value per symbol'''
+
+        if isinstance(signals,pd.DataFrame):
+            signals = signals.reindex(index = self.datahandler.date_index,columns = self.datahandler.sym_list)
+            quantity = pd.Series(quantity,index = self.datahandler.sym_list) if np.ndim(quantity) else quantity
+        return self.test_targets(signals*quantity,bars_to_load,cash,time)
+
+    def test_targets(self,targets,bars_to_load,cash = 100000,time = 'close'):
+
+        '''Tests a strategy that holds the target quantity of each symbol after trading on each bar
+
+        inputs:
+        targets (pandas dataframe or numpy array): target quantity for each bar (rows) and symbol (columns). Negative values are short
+            positions. A dataframe is aligned to the date index and sym_list; nan or missing values keep the previous target
+        bars_to_load (int): same as Backtest.test_strategy, used to determine which symbols are available on each bar
+        cash (float): amount of cash to start the test with. Default is 100,000
+        time (string): 'open' or 'close', the time of the bar the orders fill at. Default is 'close' '''
+
+        datahandler = self.datahandler
+        if time not in ('open','close'):
+            raise ValueError("time must be 'open' or 'close'")
+
+        targets = _prepare_targets(datahandler,targets)
+        available = _available_matrix(datahandler,bars_to_load)
+        no_of_bars,no_of_syms = targets.shape
+        close = datahandler._prices[:,datahandler._field_to_row['close'],:].T
+        price = datahandler._prices[:,datahandler._field_to_row[time],:].T
+
+        #positions after trading: the strategy only trades available symbols and only after the first bar
+        quantity = np.where(available,targets,0.0)
+        quantity[0] = 0.0
+        previous = np.zeros_like(quantity)
+        previous[1:] = quantity[:-1]
+
+        #positions held on the previous bar whose symbol is not available are closed at the previous close
+        delisted = (previous != 0) & ~available
+        previous_close = np.zeros_like(close)
+        previous_close[1:] = close[:-1]
+        delisted_value = np.abs(previous)*np.where(delisted,previous_close,0.0)
+        held_before = np.where(available,previous,0.0)
+
+        order = quantity-held_before
+        fill_price = np.where(order != 0,price,0.0)
+        #a sale from a long position pays back borrowed funds up to the size of the long position, the rest opens a short
+        sold_long = np.where(order < 0,np.minimum(-order,np.maximum(held_before,0.0)),0.0)
+        shorted = np.where(order < 0,-order-sold_long,0.0)
+
+        #every cash movement as (bar, sequence within the bar, kind, amount). Delisted longs then delisted shorts are closed
+        #before any order and the orders follow symbol order
+        events = []
+        rows = np.arange(no_of_syms)
+        for mask,kind,amount,sequence in ((delisted & (previous > 0),_SELL,delisted_value,np.zeros(no_of_syms)),
+                                          (delisted & (previous < 0),_BUY,delisted_value,np.ones(no_of_syms)),
+                                          (order > 0,_BUY,order*fill_price,2+3*rows),
+                                          (sold_long > 0,_SELL,sold_long*fill_price,3+3*rows),
+                                          (shorted > 0,_SHORT,shorted*fill_price,4+3*rows)):
+            bars,columns = np.nonzero(mask)
+            events.append((bars,sequence[columns],np.full(len(bars),kind),amount[bars,columns]))
+        event_bars,event_sequence,event_kinds,event_amounts = [np.concatenate(part) for part in zip(*events)]
+        ordered = np.lexsort((event_sequence,event_bars))
+        event_bars,event_kinds,event_amounts = event_bars[ordered],event_kinds[ordered],event_amounts[ordered]
+
+        event_cash,event_borrowed = self._apply_cash_movements(cash,event_kinds,event_amounts)
+
+        #the account after the last cash movement of each bar, carried forward over bars without any
+        last_event = np.searchsorted(event_bars,np.arange(no_of_bars),side = 'right')-1
+        cash_history = np.where(last_event >= 0,np.append(event_cash,cash)[last_event],cash)
+        borrowed_history = np.where(last_event >= 0,np.append(event_borrowed,0.0)[last_event],0.0)
+        value = (quantity*np.where(quantity != 0,close,0.0)).sum(axis = 1)+cash_history-borrowed_history
+
+        self.history = AccountHistory(datahandler.date_index,datahandler.sym_list,cash)
+        self.history.cash[:] = cash_history
+        self.history.borrowed_funds[:] = borrowed_history
+        self.history.value[:] = value
+        self.history.set_positions(quantity)
+        self.quantity = quantity
+
+    def _apply_cash_movements(self,cash,kinds,amounts):
+        #returns the cash and borrowed funds after each cash movement
+        flows = np.where(kinds == _BUY,-amounts,amounts)
+        net_cash = cash+np.cumsum(flows)
+        if len(flows) == 0 or net_cash.min() >= 0:
+            #funds are never borrowed, so cash is the running sum of the movements
+            return net_cash,np.zeros(len(flows))
+
+        #cash and borrowed funds depend on the order of the movements once funds are borrowed
+        event_cash = np.empty(len(flows))
+        event_borrowed = np.empty(len(flows))
+        borrowed = 0.0
+        for i,(kind,amount) in enumerate(zip(kinds.tolist(),amounts.tolist())):
+            if kind == _BUY:
+                if amount <= cash:
+                    cash = cash-amount
+                else:
+                    borrowed = borrowed+(amount-cash)
+                    cash = 0
+            elif kind == _SELL:
+                if amount >= borrowed:
+                    cash = cash+(amount-borrowed)
+                    borrowed = 0
+                else:
+                    borrowed = borrowed-amount
+            else:
+                cash = cash+amount
+            event_cash[i] = cash
+            event_borrowed[i] = borrowed
+        return event_cash,event_borrowed
+
+    @property
+    def account_history(self):
+
+        '''Dataframe in the same format as Account.account_history'''
+
+        return self.history.account_history(self.datahandler._field_array('close'))
+
+    @property
+    def account_results(self):
+
+        '''Dataframe with the cash and account value for each bar, in the same format as Account.account_results'''
+
+        return self.history.account_results()
@@ -0,0 +1,259 @@
+'''Author: Jacob Atnip'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from backtest import Backtest,Strategy
+
+#Benchmark suite for the backtester. Generates a synthetic OHLCV universe, times Backtest.test_strategy, DataHandler.data,
+#Account valuation and the Analysis metrics and writes the throughput and peak memory to a JSON file. Every run with the
+#same arguments uses the same universe and orders, so results can be compared across versions with --compare
+#
+#   python benchmark.py --symbols 500 --bars 2000 --orders-per-bar 20 --output results.json --compare baseline.json
+
+BENCHMARK_VERSION = 1
+
+def synthetic_universe(no_of_symbols,no_of_bars,delisting_rate = 0.1,seed = 0):
+
+    '''Returns a series of OHLCV dataframes in the format used by DataHandler.add_data_series. Prices follow geometric
+    random walks. Symbols are listed on a random bar in the first tenth of the calendar and a delisting_rate fraction of
+    them is delisted on a random bar after that
+
+    inputs:
+    no_of_symbols (int): number of symbols
+    no_of_bars (int): number of bars in the calendar
+    delisting_rate (float): fraction of symbols delisted before the last bar. Default is 0.1
+    seed (int): random seed. Default is 0'''
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2000-01-03',periods = no_of_bars,freq = 'B')
+    first_bars = rng.integers(0,max(no_of_bars//10,1),no_of_symbols)
+    last_bars = np.full(no_of_symbols,no_of_bars)
+    delisted = rng.random(no_of_symbols) < delisting_rate
+    last_bars[delisted] = rng.integers(first_bars[delisted]+1,no_of_bars+1)
+
+    returns = rng.normal(0.0003,0.015,(no_of_symbols,no_of_bars))
+    close = 20*np.exp(rng.normal(0,0.5,(no_of_symbols,1))+np.cumsum(returns,axis = 1))
+    gap = rng.normal(0,0.003,(no_of_symbols,no_of_bars))
+    open_ = np.concatenate((close[:,:1],close[:,:-1]),axis = 1)*(1+gap)
+    high = np.maximum(open_,close)*(1+np.abs(rng.normal(0,0.005,(no_of_symbols,no_of_bars))))
+    low = np.minimum(open_,close)*(1-np.abs(rng.normal(0,0.005,(no_of_symbols,no_of_bars))))
+    volume = rng.integers(100000,5000000,(no_of_symbols,no_of_bars)).astype(np.float64)
+
+    data = {}
+    for row in range(no_of_symbols):
+        bars = slice(first_bars[row],last_bars[row])
+        data['SYM%05d' % row] = pd.DataFrame({'open':open_[row,bars],'high':high[row,bars],'low':low[row,bars],
+                                              'close':close[row,bars],'volume':volume[row,bars]},index = dates[bars])
+    return pd.Series(data,dtype = object)
+
+class BenchmarkStrategy(Strategy):
+
+    '''Reads the close of one symbol and places orders_per_bar market orders on random available symbols every bar,
+    alternating between orders for the close and orders for the next open'''
+
+    orders_per_bar = 10
+    seed = 0
+
+    def strategy_logic_begin(self):
+        pass
+
+    def strategy_logic_end(self):
+        if not hasattr(self,'_rng'):
+            self._rng = np.random.default_rng(self.seed)
+        available = self.datahandler.available_symbols
+        if not available:
+            return
+        self.datahandler.data(available[0],'close',self.datahandler._bars_to_load)
+        rows = self._rng.integers(0,len(available),self.orders_per_bar)
+        quantities = self._rng.integers(-50,51,self.orders_per_bar)
+        time = 'close' if self.datahandler._current_bar % 2 else 'open'
+        for row,quantity in zip(rows.tolist(),quantities.tolist()):
+            if quantity != 0:
+                self.execution.market_order(available[row],quantity,time)
+
+def _new_backtest(series,orders_per_bar,seed):
+    #creates a backtest of the benchmark strategy on the universe
+    class Benchmark(BenchmarkStrategy):
+        pass
+    Benchmark.orders_per_bar = orders_per_bar
+    Benchmark.seed = seed
+    backtest = Backtest(strategy = Benchmark)
+    backtest.datahandler.add_data_series(series)
+    return backtest
+
+def _move_to_bar(backtest,bars_to_load,bar):
+    #runs the data handler to the end of a bar without running the strategy
+    backtest.datahandler._create_date_iter(bars_to_load)
+    backtest._reset_test(100000)
+    for i in range(bar+1):
+        backtest.datahandler._update_date_symbols()
+    backtest.datahandler._tob = 'end'
+
+def bench_test_strategy(series,bars_to_load,orders_per_bar,seed,memory = True):
+
+    '''Times Backtest.test_strategy and returns the bars and orders per second, and the peak memory of a second traced run'''
+
+    backtest = _new_backtest(series,orders_per_bar,seed)
+    start = time.perf_counter()
+    backtest.test_strategy(bars_to_load,progress_bar = False)
+    seconds = time.perf_counter()-start
+    bars = len(backtest.datahandler.date_index)
+    orders = len(backtest.execution.order_log.orders)
+    results = {'seconds':seconds,
+               'bars':bars,
+               'bars per second':bars/seconds,
+               'orders':orders,
+               'fills':len(backtest.execution.order_log.fills),
+               'orders per second':orders/seconds}
+
+    if memory:
+        #tracing slows the backtest down, so memory is measured in its own run
+        backtest = _new_backtest(series,orders_per_bar,seed)
+        tracemalloc.start()
+        backtest.test_strategy(bars_to_load,progress_bar = False)
+        results['peak memory MB'] = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+    return results,backtest
+
+def bench_data(series,bars_to_load,calls,seed):
+
+    '''Times DataHandler.data and DataHandler.data_view calls for random available symbols at the middle bar'''
+
+    backtest = _new_backtest(series,0,seed)
+    datahandler = backtest.datahandler
+    _move_to_bar(backtest,bars_to_load,len(datahandler.date_index)//2)
+    available = datahandler.available_symbols
+    symbols = [available[row] for row in np.random.default_rng(seed).integers(0,len(available),calls).tolist()]
+
+    results = {'calls':calls}
+    for method in ('data','data_view'):
+        function = getattr(datahandler,method)
+        start = time.perf_counter()
+        for symbol in symbols:
+            function(symbol,'close',bars_to_load)
+        seconds = time.perf_counter()-start
+        results[method+' calls per second'] = calls/seconds
+    return results
+
+def bench_valuation(series,bars_to_load,calls,seed):
+
+    '''Times Account._mark_to_market with a position in every available symbol at the middle bar'''
+
+    backtest = _new_backtest(series,0,seed)
+    datahandler = backtest.datahandler
+    _move_to_bar(backtest,bars_to_load,len(datahandler.date_index)//2)
+    ledger = backtest.account.ledger
+    prices = datahandler._current_prices('close')
+    for row in datahandler._available_rows.tolist():
+        ledger.fill(row,100,prices[row],datahandler._current_bar,-1)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        backtest.account._mark_to_market('close')
+    seconds = time.perf_counter()-start
+    return {'positions':len(ledger.held_rows),'calls':calls,'calls per second':calls/seconds}
+
+def bench_analysis(backtest,repeat):
+
+    '''Times the CAGR, drawdown and CAGR/MDD calculations of a finished backtest'''
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        backtest.analysis._calc_CAGRMDD()
+    seconds = time.perf_counter()-start
+    return {'calls':repeat,'seconds per call':seconds/repeat}
+
+def _git_commit():
+    #returns the commit of the working tree, or None outside a git repository
+    try:
+        return subprocess.run(['git','rev-parse','HEAD'],capture_output = True,text = True,check = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(no_of_symbols = 200,no_of_bars = 1000,delisting_rate = 0.1,orders_per_bar = 10,bars_to_load = 20,
+                   seed = 0,data_calls = 20000,valuation_calls = 2000,memory = True):
+
+    '''Runs every benchmark and returns the results as a dictionary that can be written to JSON'''
+
+    config = {'symbols':no_of_symbols,'bars':no_of_bars,'delisting rate':delisting_rate,'orders per bar':orders_per_bar,
+              'bars to load':bars_to_load,'seed':seed}
+
+    start = time.perf_counter()
+    series = synthetic_universe(no_of_symbols,no_of_bars,delisting_rate,seed)
+    universe_seconds = time.perf_counter()-start
+
+    start = time.perf_counter()
+    _new_backtest(series,orders_per_bar,seed)
+    load_seconds = time.perf_counter()-start
+
+    test_strategy,backtest = bench_test_strategy(series,bars_to_load,orders_per_bar,seed,memory)
+    return {'benchmark version':BENCHMARK_VERSION,
+            'date':pd.Timestamp.now().isoformat(),
+            'commit':_git_commit(),
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'pandas':pd.__version__,
+            'config':config,
+            'results':{'universe seconds':universe_seconds,
+                       'add_data_series seconds':load_seconds,
+                       'test_strategy':test_strategy,
+                       'data':bench_data(series,bars_to_load,data_calls,seed),
+                       'valuation':bench_valuation(series,bars_to_load,valuation_calls,seed),
+                       'analysis':bench_analysis(backtest,10)}}
+
+def _flatten(results,prefix = ''):
+    #flattens nested result dictionaries into {'a/b': value}
+    flat = {}
+    for key,value in results.items():
+        if isinstance(value,dict):
+            flat.update(_flatten(value,prefix+key+'/'))
+        else:
+            flat[prefix+key] = value
+    return flat
+
+def compare(results,baseline):
+
+    '''Returns a dataframe comparing every numeric result with a baseline run. The ratio is the current result divided by the
+    baseline, so a ratio above 1 is an improvement for per second results and a regression for seconds and memory'''
+
+    current = _flatten(results['results'])
+    previous = _flatten(baseline['results'])
+    rows = {key:(previous[key],current[key],current[key]/previous[key]) for key in current
+            if key in previous and isinstance(current[key],(int,float)) and previous[key]}
+    return pd.DataFrame.from_dict(rows,orient = 'index',columns = ['baseline','current','ratio'])
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmarks the backtester on a synthetic universe')
+    parser.add_argument('--symbols',type = int,default = 200)
+    parser.add_argument('--bars',type = int,default = 1000)
+    parser.add_argument('--delisting-rate',type = float,default = 0.1)
+    parser.add_argument('--orders-per-bar',type = int,default = 10)
+    parser.add_argument('--bars-to-load',type = int,default = 20)
+    parser.add_argument('--seed',type = int,default = 0)
+    parser.add_argument('--no-memory',action = 'store_true',help = 'skip the traced run used to measure peak memory')
+    parser.add_argument('--output',default = 'benchmark_results.json',help = 'JSON file to write the results to')
+    parser.add_argument('--compare',default = None,help = 'JSON file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.symbols,args.bars,args.delisting_rate,args.orders_per_bar,args.bars_to_load,args.seed,
+                             memory = not args.no_memory)
+    with open(args.output,'w') as file:
+        json.dump(results,file,indent = 2)
+    print(json.dumps(results['results'],indent = 2))
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['config'] != results['config']:
+            print('warning: the baseline was run with a different config')
+        print(compare(results,baseline).to_string())
+
+if __name__ == '__main__':
+    main()
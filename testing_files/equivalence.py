@@ -0,0 +1,93 @@
+'''Author: Jacob Atnip'''
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+from backtest import Backtest,DataHandler
+from backtest.vectorized import TargetPositionStrategy,VectorizedBacktest
+from benchmark import synthetic_universe
+
+#Equivalence check of the two engines. Runs random target positions through the event loop (TargetPositionStrategy) and
+#the vectorized engine (VectorizedBacktest.test_targets) on synthetic universes with delistings, and checks that the
+#account results and account history of both are the same. Targets include short positions and positions large enough
+#to borrow funds. Exits with status 1 when any case differs
+#
+#   python equivalence.py --symbols 20 --bars 500 --seeds 5
+
+def random_targets(date_index,sym_list,scale,hold_rate = 0.6,seed = 0):
+
+    '''Returns a dataframe of target quantities between -3*scale and 3*scale. A hold_rate fraction of the targets is NaN,
+    which keeps the previous target
+
+    inputs:
+    date_index (pandas index): dates of the targets
+    sym_list (list): symbols of the targets
+    scale (float): units of one step of the targets
+    hold_rate (float): fraction of bars that keep the previous target. Default is 0.6
+    seed (int): random seed. Default is 0'''
+
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(-3,4,(len(date_index),len(sym_list))).astype(np.float64)*scale
+    targets[rng.random(targets.shape) < hold_rate] = np.nan
+    return pd.DataFrame(targets,index = date_index,columns = sym_list)
+
+def compare_engines(series,targets,time,bars_to_load = 5,cash = 100000):
+
+    '''Backtests targets with both engines and returns the largest absolute difference of the account results and of the
+    account history, and the largest borrowed funds of the event loop'''
+
+    class Targets(TargetPositionStrategy):
+        pass
+    Targets.targets = targets
+    Targets.time = time
+    backtest = Backtest(strategy = Targets)
+    backtest.datahandler.add_data_series(series)
+    backtest.test_strategy(bars_to_load,cash,progress_bar = False)
+
+    datahandler = DataHandler()
+    datahandler.add_data_series(series)
+    vectorized = VectorizedBacktest(datahandler)
+    vectorized.test_targets(targets,bars_to_load,cash,time)
+
+    results = np.abs(backtest.account.account_results.to_numpy()-vectorized.account_results.to_numpy())
+    history = np.abs(backtest.account.account_history.to_numpy(dtype = np.float64)-
+                     vectorized.account_history.to_numpy(dtype = np.float64))
+    borrowed = backtest.account.account_history['account']['borrowed funds'].max()
+    return np.nanmax(results),np.nanmax(history),borrowed
+
+def run_checks(no_of_symbols = 20,no_of_bars = 500,delisting_rate = 0.3,seeds = 3,tolerance = 1e-6):
+
+    '''Compares the engines for every seed, time of execution and target scale and returns a dataframe with one row per case'''
+
+    rows = []
+    for seed in range(seeds):
+        series = synthetic_universe(no_of_symbols,no_of_bars,delisting_rate,seed)
+        datahandler = DataHandler()
+        datahandler.add_data_series(series)
+        for time in ('open','close'):
+            #small targets stay within the cash, large targets borrow funds
+            for scale in (10,1000):
+                targets = random_targets(datahandler.date_index,datahandler.sym_list,scale,seed = seed+100)
+                results,history,borrowed = compare_engines(series,targets,time)
+                rows.append((seed,time,scale,results,history,borrowed,max(results,history) <= tolerance))
+    return pd.DataFrame(rows,columns = ['seed','time','scale','results difference','history difference',
+                                        'max borrowed funds','equal'])
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Checks that the event loop and the vectorized engine give the same results')
+    parser.add_argument('--symbols',type = int,default = 20)
+    parser.add_argument('--bars',type = int,default = 500)
+    parser.add_argument('--delisting-rate',type = float,default = 0.3)
+    parser.add_argument('--seeds',type = int,default = 3)
+    parser.add_argument('--tolerance',type = float,default = 1e-6,help = 'largest absolute difference allowed')
+    args = parser.parse_args()
+
+    checks = run_checks(args.symbols,args.bars,args.delisting_rate,args.seeds,args.tolerance)
+    print(checks.to_string())
+    if not checks['equal'].all():
+        print('the engines differ in '+str((~checks['equal']).sum())+' of '+str(len(checks))+' cases')
+        sys.exit(1)
+    print('the engines are equal in all '+str(len(checks))+' cases')
+
+if __name__ == '__main__':
+    main()